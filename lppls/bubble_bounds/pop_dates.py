@@ -2,12 +2,31 @@
 # Dissection of Bitcoin’s Multiscale Bubble History from January 2012 to February 2018
 # J.C. Gerlach† , G. Demos†, D. Sornette†♮
 
-from typing import List
-from lppls.lppls_defaults import MIN_NR_CLUSTERS, MAX_NR_CLUSTERS
+from typing import Dict, List, Tuple
+from multiprocessing import Pool
+from lppls.lppls_defaults import (
+    MIN_NR_CLUSTERS,
+    MAX_NR_CLUSTERS,
+    BOOTSTRAP_RESAMPLES,
+    BOOTSTRAP_MAX_WINDOWS,
+    BOOTSTRAP_WORKERS,
+    BOOTSTRAP_BLOCK_SIZE,
+    TC_QUANTILES,
+    POP_RANGE_QUANTILES,
+)
 from sklearn.cluster import KMeans
 from sklearn.metrics import silhouette_score
 import numpy as np
-from lppls.lppls_dataclasses import BubbleStart, BubbleScore
+from lppls.differential_evolution import DifferentialEvolution
+from lppls.filter_interface import FilterInterface
+from lppls.lppls_math import LPPLSMath, SINGULAR_FIT_COST
+from lppls.lppls_dataclasses import (
+    BubbleStart,
+    BubbleScore,
+    ObservationSeries,
+    OptimizedInterval,
+    OptimizedParams,
+)
 from prices_db_management.db_dataclasses import PopRange
 from common.date_utils import DateUtils as du
 from common.typechecking import TypeCheckBase
@@ -65,11 +84,57 @@ class Cluster(TypeCheckBase):
         return PopRange(first_pop_date, last_pop_date)
 
 
+# The tcs of the qualified fits refitted on resampled data. Unlike the cluster centers, the spread
+# of the distribution also reflects how precisely each window pins down its tc.
+class TcDistribution(TypeCheckBase):
+    def __init__(self, tcs: np.ndarray | None = None, windows: int = 0):
+        self.tcs = np.sort(tcs) if tcs is not None else np.array([])
+        self.windows = windows
+        self.is_valid = len(self.tcs) >= MIN_POINTS_CLUSTER_RATIO * MIN_NR_CLUSTERS
+
+    def quantile(self, q: float) -> int:
+        return int(round(float(np.quantile(self.tcs, q))))
+
+    def quantiles(self) -> Dict[float, int]:
+        if not self.is_valid:
+            return {}
+        return {q: self.quantile(q) for q in TC_QUANTILES}
+
+    def displayDistribution(self) -> str:
+        if not self.is_valid:
+            return "Invalid distribution"
+        format_quantiles = [
+            f"{q:.0%}: {du.ordinal_to_date(tc)}" for q, tc in self.quantiles().items()
+        ]
+        return (
+            f"tc quantiles {format_quantiles} from {len(self.tcs)} weighted refits of "
+            f"{self.windows} windows"
+        )
+
+    def give_pop_dates_range(self, test_date) -> PopRange | None:
+        if not self.is_valid:
+            return None
+
+        first_pop_date, last_pop_date = (self.quantile(q) for q in POP_RANGE_QUANTILES)
+
+        # The same conditions as for the cluster centers
+        if last_pop_date - first_pop_date > MAX_POP_TIMES_DISPERSION:
+            return None
+        if last_pop_date > du.date_to_ordinal(test_date) + MAX_LAG_FROM_TODAY:
+            return None
+
+        return PopRange(first_pop_date, last_pop_date)
+
+
 class PopDates(TypeCheckBase):
-    def compute_bubble_end_cluster(
+    def get_qualified_intervals(
         self, start_time: BubbleStart, bubble_scores: List[BubbleScore], test_date: str
-    ) -> Cluster:
-        tcs = []
+    ) -> List[OptimizedInterval]:
+        """
+        The intervals that were not rejected, that start after the bubble start, in the windows
+        ending in the last LAST_DAYS_WITH_DATA days.
+        """
+        qualified_intervals = []
 
         # Get the ordinal dates for the last LAST_DAYS_WITH_DATA days
         last_days_ordinals = [
@@ -81,7 +146,18 @@ class PopDates(TypeCheckBase):
                 continue
             for oi in bubble_score.optimized_intervals:
                 if not oi.bubble_fit.rejection_reasons and oi.t1 >= start_time.date_ordinal:
-                    tcs.append([oi.optimized_params.tc])  # need 2D array
+                    qualified_intervals.append(oi)
+        return qualified_intervals
+
+    def compute_bubble_end_cluster(
+        self, start_time: BubbleStart, bubble_scores: List[BubbleScore], test_date: str
+    ) -> Cluster:
+        # with adaptive t1 steps, a fit also stands for the nested windows next to it
+        tcs = [
+            [oi.optimized_params.tc]  # need 2D array
+            for oi in self.get_qualified_intervals(start_time, bubble_scores, test_date)
+            for _ in range(oi.weight)
+        ]
 
         print("Number of tcs considered in clustering: ", len(tcs))
         if len(tcs) < MIN_POINTS_CLUSTER_RATIO * MIN_NR_CLUSTERS:
@@ -102,3 +178,86 @@ class PopDates(TypeCheckBase):
 
         best_cluster = min(clusters, key=lambda c: 1 - c.silhouette)
         return best_cluster
+
+    def bootstrap_window(
+        self, args: Tuple[ObservationSeries, OptimizedParams, List[Tuple[float, float]], int, int]
+    ) -> np.ndarray:
+        """
+        Residual bootstrap of one window: its fitted prices plus its residuals, resampled in blocks
+        of BOOTSTRAP_BLOCK_SIZE days, refitted by one batched differential evolution.
+        Returns:
+            The tc of every resample that could be fitted.
+        """
+        observations, optimized_params, search_bounds, seed, resamples = args
+        date_ordinals = np.asarray(observations.get_date_ordinals(), dtype=float)
+        log_prices = np.asarray(observations.get_log_prices(), dtype=float)
+        predicted = LPPLSMath.predict_log_prices(date_ordinals, optimized_params)
+        residuals = log_prices - predicted
+
+        rng = np.random.default_rng(seed)
+        size = len(residuals)
+        block_size = min(BOOTSTRAP_BLOCK_SIZE, size)
+        blocks = -(-size // block_size)
+        starts = rng.integers(size - block_size + 1, size=(resamples, blocks))
+        indexes = (starts[..., None] + np.arange(block_size)).reshape(resamples, -1)[:, :size]
+        resampled_log_prices = predicted + residuals[indexes]
+
+        # the fit of the original window seeds every resample, as a warm start
+        seeds = [[np.array([optimized_params.tc, optimized_params.m, optimized_params.w])]]
+        de = DifferentialEvolution(
+            np.repeat([search_bounds], resamples, axis=0), rng.spawn(resamples)
+        )
+        best_x, best_costs = de.evolve(
+            np.repeat(date_ordinals[None], resamples, axis=0),
+            resampled_log_prices,
+            seeds * resamples,
+        )
+        return best_x[best_costs < SINGULAR_FIT_COST, 0]
+
+    def compute_tc_distribution(
+        self,
+        observations: ObservationSeries,
+        filter: FilterInterface,
+        start_time: BubbleStart,
+        bubble_scores: List[BubbleScore],
+        test_date: str,
+        resamples: int = BOOTSTRAP_RESAMPLES,
+        max_windows: int = BOOTSTRAP_MAX_WINDOWS,
+        workers: int = BOOTSTRAP_WORKERS,
+        ticker: str = "",
+    ) -> TcDistribution:
+        """
+        Args:
+            observations: The series the bubble scores were computed on, the interval indexes
+                point into it.
+            resamples, max_windows, workers: The CPU budget. Only the max_windows qualified
+                intervals with the latest t2 are resampled, resamples times each, on workers
+                processes (1 runs in this process).
+        Returns:
+            The bootstrap distribution of tc over the intervals compute_bubble_end_cluster uses.
+        """
+        qualified_intervals = self.get_qualified_intervals(start_time, bubble_scores, test_date)
+        qualified_intervals.sort(key=lambda oi: oi.t2, reverse=True)
+        qualified_intervals = qualified_intervals[:max_windows]
+
+        args = []
+        for oi in qualified_intervals:
+            window = observations.get_between_indexes(oi.t1_index, oi.t2_index)
+            # seeded by the window, so the distribution is the same in every run
+            seed = int(filter.get_window_rng(window, ticker).integers(2**63))
+            args.append(
+                (window, oi.optimized_params, filter.get_search_bounds(window), seed, resamples)
+            )
+
+        if workers > 1 and len(args) > 1:
+            with Pool(processes=min(workers, len(args))) as pool:
+                window_tcs = pool.map(self.bootstrap_window, args)
+        else:
+            window_tcs = [self.bootstrap_window(window_args) for window_args in args]
+
+        # weighted like the clustering
+        window_tcs = [np.repeat(tcs, oi.weight) for tcs, oi in zip(window_tcs, qualified_intervals)]
+        print(f"Number of weighted tcs in the bootstrap distribution: {sum(map(len, window_tcs))}")
+        if not window_tcs:
+            return TcDistribution()
+        return TcDistribution(np.concatenate(window_tcs), len(qualified_intervals))
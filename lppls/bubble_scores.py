@@ -7,11 +7,13 @@ from lppls.lppls_dataclasses import (
     IntervalFits,
     BubbleScore,
     RejectionReason,
+    BubbleFit,
 )
 from lppls.bubble_bounds.pop_dates import Cluster
 from matplotlib.lines import Line2D
 from lppls.filter_interface import FilterInterface
-from typing import List
+from lppls.lppls_defaults import SAMPLED_CONF_Z
+from typing import Dict, List, Tuple
 from common.date_utils import DateUtils as du
 import matplotlib.dates as mdates
 from common.typechecking import TypeCheckBase
@@ -103,13 +105,16 @@ class BubbleScores(TypeCheckBase):
 
         # Calculate and plot rejection reasons
         colors = ["blue", "orange", "purple", "brown", "cyan", "gray"]
-        rejection_percentages = {reason: [] for reason in RejectionReason}
+        rejection_percentages: Dict[RejectionReason, List[float]] = {
+            reason: [] for reason in RejectionReason
+        }
         for bs in bubble_scores:
-            total_intervals = len(bs.optimized_intervals)
+            # weighted like the bubble confidence
+            total_intervals = sum(interval.weight for interval in bs.optimized_intervals)
             counts = {reason: 0 for reason in RejectionReason}
             for interval in bs.optimized_intervals:
                 for reason in interval.bubble_fit.rejection_reasons:
-                    counts[reason] += 1
+                    counts[reason] += interval.weight
             for reason, count in counts.items():
                 rejection_percentages[reason].append(
                     (count / total_intervals) * 100 if total_intervals > 0 else 0
@@ -184,6 +189,45 @@ class BubbleScores(TypeCheckBase):
             handles=axis.get_legend_handles_labels()[0] + cluster_legend, loc=2, facecolor="white"
         )
 
+    @staticmethod
+    def get_conf_error(qualified: int, count: int, sampled: int, population: int) -> float:
+        """
+        Half-width of the Wilson score interval of qualified / count, with the finite population
+        correction of sampling `sampled` out of `population` nested windows without replacement.
+        Args:
+            qualified, count: The qualified windows of one bubble type and all windows of that type.
+            sampled: The windows that were fitted, including the failed fits.
+        """
+        if count == 0 or sampled >= population:
+            return 0.0
+
+        conf = qualified / count
+        z2 = SAMPLED_CONF_Z**2
+        center = (conf + z2 / (2 * count)) / (1 + z2 / count)
+        half_width = (
+            SAMPLED_CONF_Z
+            / (1 + z2 / count)
+            * np.sqrt(conf * (1 - conf) / count + z2 / (4 * count**2))
+        )
+        error = max(abs(center - half_width - conf), abs(center + half_width - conf))
+        return float(error * np.sqrt((population - sampled) / population))
+
+    @staticmethod
+    def count_bubble_fits(bubble_fits: List[BubbleFit]) -> Tuple[int, int, int, int]:
+        """
+        Returns:
+            The qualified positive, positive, qualified negative and negative fits.
+        """
+        pos_qual_count = pos_count = neg_qual_count = neg_count = 0
+        for bubble_fit in bubble_fits:
+            if bubble_fit.type == BubbleType.POSITIVE:
+                pos_count += 1
+                pos_qual_count += not bubble_fit.rejection_reasons
+            else:
+                neg_count += 1
+                neg_qual_count += not bubble_fit.rejection_reasons
+        return pos_qual_count, pos_count, neg_qual_count, neg_count
+
     def compute_bubble_scores(
         self, all_fits: List[IntervalFits], should_optimize: bool
     ) -> List[BubbleScore]:
@@ -200,17 +244,28 @@ class BubbleScores(TypeCheckBase):
                     optimizedInterval, self.observations, should_optimize
                 )
 
+                # with adaptive t1 steps, a fit also counts for the nested windows it stands for
+                weight = optimizedInterval.weight
                 if bubble_fit.type == BubbleType.POSITIVE:
-                    pos_count += 1
+                    pos_count += weight
                     if not bubble_fit.rejection_reasons:
-                        pos_qual_count += 1
+                        pos_qual_count += weight
                 else:
-                    neg_count += 1
+                    neg_count += weight
                     if not bubble_fit.rejection_reasons:
-                        neg_qual_count += 1
+                        neg_qual_count += weight
 
                 fit.optimized_intervals[idx].bubble_fit = bubble_fit
 
+            pos_conf_error, neg_conf_error = 0.0, 0.0
+            if fit.sampled_windows < fit.nested_windows:
+                pos_conf_error = self.get_conf_error(
+                    pos_qual_count, pos_count, fit.sampled_windows, fit.nested_windows
+                )
+                neg_conf_error = self.get_conf_error(
+                    neg_qual_count, neg_count, fit.sampled_windows, fit.nested_windows
+                )
+
             bubble_scores.append(
                 BubbleScore(
                     fit.t2,
@@ -218,6 +273,8 @@ class BubbleScores(TypeCheckBase):
                     pos_qual_count / pos_count if pos_count > 0 else 0,
                     neg_qual_count / neg_count if neg_count > 0 else 0,
                     fit.optimized_intervals,
+                    pos_conf_error,
+                    neg_conf_error,
                 )
             )
 
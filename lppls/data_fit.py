@@ -1,30 +1,111 @@
-from typing import List
-from lppls.lppls_math import LPPLSMath
+from typing import Dict, List, Tuple
+from math import ceil
+import time
+import numpy as np
+from lppls.lppls_math import LPPLSMath, SINGULAR_FIT_COST
 from tqdm import tqdm
 from matplotlib import pyplot as plt
 from multiprocessing import Pool
-from lppls.lppls_defaults import LARGEST_WINDOW_SIZE, SMALLEST_WINDOW_SIZE, T1_STEP, T2_STEP
+from lppls.lppls_defaults import (
+    LARGEST_WINDOW_SIZE,
+    SMALLEST_WINDOW_SIZE,
+    T1_STEP,
+    T2_STEP,
+    LARGEST_WINDOW_SIZE_STRICT,
+    SMALLEST_WINDOW_SIZE_STRICT,
+    T1_STEP_STRICT,
+    LARGEST_WINDOW_SIZE_SHORT,
+    SMALLEST_WINDOW_SIZE_SHORT,
+    T1_STEP_SHORT,
+    NESTED_SEED_TC_GRID_SIZE,
+    NESTED_SEED_M_GRID_SIZE,
+    NESTED_SEED_W_GRID_SIZE,
+    NESTED_SEEDS_PER_WINDOW,
+    MAX_SEARCHES,
+    TRIES_TO_GET_MINIMUM,
+    WARM_START_MAX_SSR_RATIO,
+    ADAPTIVE_T1_COARSE_STEPS,
+    ADAPTIVE_T1_TC_TOLERANCE,
+    SAMPLED_T1_BATCH_SIZE,
+    SAMPLED_T1_MIN_WINDOWS,
+    SAMPLED_CONF_MAX_ERROR,
+    BUBBLE_THRESHOLD,
+)
 from lppls.lppls_dataclasses import (
     BubbleStart,
     ObservationSeries,
     OptimizedInterval,
     IntervalFits,
     OptimizedParams,
+    FitStrategy,
+    FitStats,
+    RestartPolicy,
+    FitCoordinates,
+    ParallelBackend,
+    WindowScale,
+    T1Stepping,
 )
 from lppls.filter_interface import FilterInterface
+from lppls.bubble_scores import BubbleScores
+from lppls.fit_cache import FitCache
+from lppls.threaded_fits import ThreadedFits
 import sys
 from common.date_utils import DateUtils as du
 import matplotlib.dates as mdates
 from common.typechecking import TypeCheckBase
 
+DEFAULT_WINDOW_SCALES = [
+    WindowScale("short", LARGEST_WINDOW_SIZE_SHORT, SMALLEST_WINDOW_SIZE_SHORT, T1_STEP_SHORT),
+    WindowScale("medium", LARGEST_WINDOW_SIZE, SMALLEST_WINDOW_SIZE, T1_STEP),
+    WindowScale("long", LARGEST_WINDOW_SIZE_STRICT, SMALLEST_WINDOW_SIZE_STRICT, T1_STEP_STRICT),
+]
+
 
 class DataFit(TypeCheckBase):
-    def __init__(self, observations: ObservationSeries, filter: FilterInterface):
+    def __init__(
+        self,
+        observations: ObservationSeries,
+        filter: FilterInterface,
+        strategy: FitStrategy = FitStrategy.RANDOM_RESTARTS,
+        ticker: str = "",
+        restart_policy: RestartPolicy = RestartPolicy.FIXED,
+        minimizer: str = "Nelder-Mead",
+        fit_cache: FitCache | None = None,
+        coordinates: FitCoordinates = FitCoordinates.RAW,
+        t1_stepping: T1Stepping = T1Stepping.FIXED,
+        conf_max_error: float = SAMPLED_CONF_MAX_ERROR,
+        max_searches: int = MAX_SEARCHES,
+        tries_to_get_minimum: int = TRIES_TO_GET_MINIMUM,
+    ):
         self.observations = observations
         self.filter = filter
+        self.strategy = strategy
+        self.restart_policy = restart_policy
+        self.minimizer = minimizer
+        self.fit_cache = fit_cache
+        self.coordinates = coordinates
+        self.t1_stepping = t1_stepping
+        # the confidence interval width T1Stepping.SAMPLED stops at
+        self.conf_max_error = conf_max_error
+        # the search budget of every nested fit
+        self.max_searches = max_searches
+        self.tries_to_get_minimum = tries_to_get_minimum
+        # only used to derive the random seeds of each window
+        self.ticker = ticker
+        # the work of all the fits computed for these observations, see FitStats
+        self.fit_stats = FitStats()
 
-    def plot_fit(self, bubble_start: BubbleStart | None, op: OptimizedParams) -> None:
-        observations = self.observations.filter_before_tc(op.tc)
+    def plot_fit(
+        self,
+        bubble_start: BubbleStart | None,
+        op: OptimizedParams,
+        observations: ObservationSeries | None = None,
+    ) -> None:
+        """
+        Args:
+            observations: The fitted window, all the observations by default.
+        """
+        observations = (observations or self.observations).filter_before_tc(op.tc)
 
         if bubble_start:
             start_date = bubble_start.date_ordinal
@@ -50,9 +131,33 @@ class DataFit(TypeCheckBase):
         plt.xticks(rotation=45)
 
     def fit(
-        self, observations: ObservationSeries, minimizer: str = "Nelder-Mead"
+        self,
+        observations: ObservationSeries,
+        minimizer: str | None = None,
+        seeds: List[np.ndarray] | None = None,
+        max_searches: int | None = None,
+        tries_to_get_minimum: int | None = None,
+        warm_seed: np.ndarray | None = None,
+        stats: FitStats | None = None,
     ) -> OptimizedParams | None:
-        return self.filter.fit(observations, minimizer)
+        start = time.perf_counter()
+        rng = self.filter.get_window_rng(observations, self.ticker)
+        optimized_params = self.filter.fit(
+            observations,
+            minimizer or self.minimizer,
+            self.strategy,
+            seeds,
+            rng,
+            max_searches or self.max_searches,
+            tries_to_get_minimum or self.tries_to_get_minimum,
+            warm_seed,
+            stats,
+            self.restart_policy,
+            self.coordinates,
+        )
+        if stats is not None:
+            stats.fit_seconds += time.perf_counter() - start
+        return optimized_params
 
     def parallel_compute_t2_recent_fits(
         self,
@@ -62,7 +167,93 @@ class DataFit(TypeCheckBase):
         smallest_window_size=SMALLEST_WINDOW_SIZE,
         t1_increment=T1_STEP,
         t2_increment=T2_STEP,
+        nested_seeding=False,
+        warm_start=False,
+        warm_start_t1=False,
+        backend=ParallelBackend.PROCESSES,
     ) -> List[IntervalFits]:
+        """
+        With warm_start, consecutive t2 windows are fitted in order within each worker and every
+        nested fit starts from the optimum of the closest nested window of the previous t2. Those
+        fits depend on how the t2 windows are split between the workers, so they are not cached.
+        With warm_start_t1, each nested fit is seeded with the optimum of the previous nested
+        window of the same t2, and stops as soon as a random search finds the same minimum. The
+        warm seed replaces the first random seed, so confidences can still differ a little from a
+        cold run.
+        With ParallelBackend.THREADS, all nested windows are fitted in this process, see
+        compute_t2_fits_threaded.
+        """
+        t2_fits_args = self.get_t2_fits_args(
+            recent_windows,
+            window_size,
+            smallest_window_size,
+            t1_increment,
+            t2_increment,
+            nested_seeding,
+            warm_start_t1,
+        )
+
+        if warm_start and self.fit_cache:
+            raise ValueError("Fits warm started from the previous t2 window can not be cached")
+
+        if backend == ParallelBackend.THREADS:
+            if warm_start or warm_start_t1:
+                raise ValueError("The thread backend does not warm start")
+            optimized_intervals = self.compute_t2_fits_threaded(t2_fits_args, workers)
+        elif warm_start:
+            # one contiguous chain of t2 windows per worker, only its first window starts cold
+            chain_length = max(ceil(len(t2_fits_args) / workers), 1)
+            chains = [
+                t2_fits_args[i : i + chain_length]
+                for i in range(0, len(t2_fits_args), chain_length)
+            ]
+            with Pool(processes=workers) as pool:
+                chained_intervals = list(
+                    tqdm(
+                        pool.imap(self.compute_t2_chain, chains),
+                        total=len(chains),
+                        dynamic_ncols=True,
+                        file=sys.stdout,
+                        position=0,
+                    )
+                )
+            optimized_intervals = [
+                interval_fits for chain in chained_intervals for interval_fits in chain
+            ]
+        else:
+            with Pool(processes=workers) as pool:
+                optimized_intervals = list(
+                    tqdm(
+                        pool.imap(self.compute_t1_fits, t2_fits_args),
+                        total=len(t2_fits_args),
+                        dynamic_ncols=True,
+                        file=sys.stdout,
+                        position=0,
+                    )
+                )
+
+        fit_stats = FitStats()
+        for interval_fits in optimized_intervals:
+            fit_stats.merge(interval_fits.fit_stats)
+        self.fit_stats.merge(fit_stats)
+        if warm_start_t1 or self.restart_policy == RestartPolicy.ADAPTIVE or self.fit_cache:
+            print(fit_stats.summary())
+
+        return optimized_intervals
+
+    def get_t2_fits_args(
+        self,
+        recent_windows,
+        window_size,
+        smallest_window_size,
+        t1_increment,
+        t2_increment,
+        nested_seeding,
+        warm_start_t1,
+    ) -> List[tuple]:
+        """
+        The compute_t1_fits arguments of the last recent_windows t2 windows.
+        """
         stop_windows_beginnings = len(self.observations) - window_size + 1
         start_windows_beginnings = max(len(self.observations) - window_size - recent_windows + 1, 0)
 
@@ -74,39 +265,428 @@ class DataFit(TypeCheckBase):
                 i,
                 smallest_window_size,
                 t1_increment,
+                nested_seeding,
+                warm_start_t1,
+                None,
             )
             t2_fits_args.append(args)
+        return t2_fits_args
+
+    def parallel_compute_multi_scale_fits(
+        self,
+        recent_windows,
+        workers,
+        scales: List[WindowScale] = DEFAULT_WINDOW_SCALES,
+        t2_increment=T2_STEP,
+        nested_seeding=False,
+        warm_start_t1=False,
+    ) -> Dict[str, List[IntervalFits]]:
+        """
+        parallel_compute_t2_recent_fits for several window scales in one pass. A nested window
+        ending at the same t2 with the same size belongs to every scale that has that size, so it
+        is fitted once and its fit is shared by those scales.
+        Nested seeding and warm starts along t1 would seed a shared window from the nested windows
+        of all scales, so its fit would differ from a run of one scale. Neither is supported.
+        Returns:
+            The fits of the t2 windows of each scale, by scale name.
+        """
+        if self.t1_stepping != T1Stepping.FIXED:
+            raise ValueError("The nested windows of all scales are fitted with fixed t1 steps")
+        if nested_seeding or warm_start_t1:
+            raise ValueError("The nested windows of all scales are fitted without seeding")
+
+        # the t2 windows of each scale, by the index right after their last observation
+        scale_window_ends: Dict[str, List[int]] = {}
+        window_sizes: Dict[int, set] = {}
+        for scale in scales:
+            window_size = scale.largest_window_size
+            stop_windows_beginnings = len(self.observations) - window_size + 1
+            start_windows_beginnings = max(
+                len(self.observations) - window_size - recent_windows + 1, 0
+            )
+            window_ends = [
+                i + window_size
+                for i in range(start_windows_beginnings, stop_windows_beginnings, t2_increment)
+            ]
+            scale_window_ends[scale.name] = window_ends
+            for window_end in window_ends:
+                window_sizes.setdefault(window_end, set()).update(scale.get_window_sizes())
+
+        # one t2 window per end, as large as the largest scale, with the nested windows of all scales
+        nested_fits_args = []
+        for window_end, sizes in sorted(window_sizes.items()):
+            window_size = max(sizes)
+            t1_index = window_end - window_size
+            starts = sorted(window_size - size for size in sizes)
+            nested_fits_args.append(
+                (
+                    self.observations.get_between_indexes(t1_index, window_end),
+                    window_size,
+                    t1_index,
+                    starts,
+                    nested_seeding,
+                    warm_start_t1,
+                    None,
+                )
+            )
 
         with Pool(processes=workers) as pool:
-            optimized_intervals = list(
+            shared_fits = list(
                 tqdm(
-                    pool.imap(self.compute_t1_fits, t2_fits_args),
-                    total=len(t2_fits_args),
+                    pool.imap(self.compute_nested_fits, nested_fits_args),
+                    total=len(nested_fits_args),
                     dynamic_ncols=True,
                     file=sys.stdout,
                     position=0,
                 )
             )
 
-        return optimized_intervals
+        fit_stats = FitStats()
+        intervals_by_size: Dict[int, Dict[int, OptimizedInterval]] = {}
+        for args, interval_fits in zip(nested_fits_args, shared_fits):
+            window_end = args[2] + args[1]
+            fit_stats.merge(interval_fits.fit_stats)
+            intervals_by_size[window_end] = {
+                oi.t2_index - oi.t1_index: oi for oi in interval_fits.optimized_intervals
+            }
+
+        scale_fits: Dict[str, List[IntervalFits]] = {}
+        scale_windows = 0
+        for scale in scales:
+            window_size = scale.largest_window_size
+            scale_fits[scale.name] = []
+            for window_end in scale_window_ends[scale.name]:
+                scale_windows += len(scale.get_window_sizes())
+                intervals = intervals_by_size[window_end]
+                last_observation = self.observations[window_end - 1]
+                scale_fits[scale.name].append(
+                    IntervalFits(
+                        t1=self.observations[window_end - window_size].date_ordinal,
+                        t2=last_observation.date_ordinal,
+                        p2=last_observation.price,
+                        optimized_intervals=[
+                            intervals[size]
+                            for size in scale.get_window_sizes()
+                            if size in intervals
+                        ],
+                    )
+                )
+
+        self.fit_stats.merge(fit_stats)
+        print(
+            f"{fit_stats.fits} nested fits shared by {scale_windows} nested windows of all scales"
+        )
+        print(fit_stats.summary())
+        return scale_fits
+
+    def compute_t2_fits_threaded(self, t2_fits_args, workers: int) -> List[IntervalFits]:
+        """
+        compute_t1_fits of all the t2 windows at once, on up to `workers` numba threads.
+        Only Nelder-Mead random restarts in raw coordinates are compiled, without a fit cache.
+        """
+        if (
+            self.strategy != FitStrategy.RANDOM_RESTARTS
+            or self.restart_policy != RestartPolicy.FIXED
+            or self.minimizer != "Nelder-Mead"
+            or self.coordinates != FitCoordinates.RAW
+            or self.t1_stepping != T1Stepping.FIXED
+            or self.fit_cache
+        ):
+            raise ValueError("The thread backend only runs Nelder-Mead random restarts")
+
+        windows: List[ObservationSeries] = []
+        windows_seeds: List[List[np.ndarray]] = []
+        for (
+            obs,
+            window_size,
+            _,
+            smallest_window_size,
+            t1_increment,
+            nested_seeding,
+            *_,
+        ) in t2_fits_args:
+            starts = list(range(0, window_size - smallest_window_size, t1_increment))
+            nested_seeds = self.get_nested_seeds(obs, starts) if nested_seeding else {}
+            for j in starts:
+                windows.append(obs[j:window_size])
+                windows_seeds.append(nested_seeds.get(j, []))
+
+        fits, windows_stats = ThreadedFits(
+            self.filter, self.ticker, self.max_searches, self.tries_to_get_minimum
+        ).fit_windows(windows, windows_seeds, workers)
+
+        all_fits: List[IntervalFits] = []
+        nested_fits = iter(zip(windows, fits, windows_stats))
+        for obs, window_size, t1_index, smallest_window_size, t1_increment, *_ in t2_fits_args:
+            optimized_intervals: List[OptimizedInterval] = []
+            fit_stats = FitStats()
+            for j in range(0, window_size - smallest_window_size, t1_increment):
+                obs_shrinking_slice, optimized_params, window_stats = next(nested_fits)
+                fit_stats.merge(window_stats)
+                if not optimized_params:
+                    continue
+
+                optimized_intervals.append(
+                    OptimizedInterval(
+                        t1=obs_shrinking_slice[0].date_ordinal,
+                        t2=obs_shrinking_slice[-1].date_ordinal,
+                        t1_index=t1_index + j,
+                        t2_index=t1_index + window_size,
+                        optimized_params=optimized_params,
+                        searches=window_stats.searches,
+                    )
+                )
+
+            all_fits.append(
+                IntervalFits(
+                    t1=obs[0].date_ordinal,
+                    t2=obs[-1].date_ordinal,
+                    p2=obs[-1].price,
+                    optimized_intervals=optimized_intervals,
+                    fit_stats=fit_stats,
+                )
+            )
+
+        return all_fits
+
+    def compute_t2_chain(self, chain) -> List[IntervalFits]:
+        chain_fits: List[IntervalFits] = []
+        for args in chain:
+            previous_fits = chain_fits[-1] if chain_fits else None
+            chain_fits.append(self.compute_t1_fits(args[:-1] + (previous_fits,)))
+        return chain_fits
 
     def compute_t1_fits(self, args) -> IntervalFits:
-        obs, window_size, t1_index, smallest_window_size, t1_increment = args
+        (
+            obs,
+            window_size,
+            t1_index,
+            smallest_window_size,
+            t1_increment,
+            nested_seeding,
+            warm_start_t1,
+            previous_fits,
+        ) = args
 
         window_delta = window_size - smallest_window_size
+        starts = list(range(0, window_delta, t1_increment))
+        if self.t1_stepping == T1Stepping.ADAPTIVE:
+            return self.compute_adaptive_t1_fits(
+                (obs, window_size, t1_index, starts, nested_seeding, warm_start_t1, previous_fits)
+            )
+        if self.t1_stepping == T1Stepping.SAMPLED:
+            return self.compute_sampled_t1_fits(
+                (obs, window_size, t1_index, starts, nested_seeding, warm_start_t1, previous_fits)
+            )
+        return self.compute_nested_fits(
+            (obs, window_size, t1_index, starts, nested_seeding, warm_start_t1, previous_fits)
+        )
+
+    def compute_adaptive_t1_fits(self, args) -> IntervalFits:
+        """
+        compute_nested_fits on every ADAPTIVE_T1_COARSE_STEPS-th start, then on the middle start
+        between every two neighbouring fits that disagree, until they agree or are adjacent.
+        Each fit is weighted by the number of starts it is the nearest fit of, so the bubble
+        confidence still counts every start.
+        """
+        obs, window_size, t1_index, starts, nested_seeding, warm_start_t1, previous_fits = args
+        if not starts:
+            return self.compute_nested_fits(args)
+
+        fit_stats = FitStats()
+        fitted_intervals: Dict[int, OptimizedInterval | None] = {}
+        new_positions = set(range(0, len(starts), ADAPTIVE_T1_COARSE_STEPS)) | {len(starts) - 1}
+        while new_positions:
+            interval_fits = self.compute_nested_fits(
+                (
+                    obs,
+                    window_size,
+                    t1_index,
+                    [starts[k] for k in sorted(new_positions)],
+                    nested_seeding,
+                    warm_start_t1,
+                    previous_fits,
+                )
+            )
+            fit_stats.merge(interval_fits.fit_stats)
+            fitted_intervals.update({k: None for k in new_positions})
+            for oi in interval_fits.optimized_intervals:
+                fitted_intervals[starts.index(oi.t1_index - t1_index)] = oi
+
+            fitted_positions = sorted(fitted_intervals)
+            new_positions = {
+                (k + next_k) // 2
+                for k, next_k in zip(fitted_positions, fitted_positions[1:])
+                if next_k - k > 1
+                and not self.are_t1_fits_alike(fitted_intervals[k], fitted_intervals[next_k])
+            }
 
-        optimized_intervals = []
+        # every start counts for its nearest fit, the larger window on ties
+        positions = np.array(sorted(fitted_intervals))
+        for k in range(len(starts)):
+            nearest = int(positions[np.argmin(np.abs(positions - k))])
+            nearest_interval = fitted_intervals[nearest]
+            if nearest_interval and nearest != k:
+                nearest_interval.weight += 1
+
+        return IntervalFits(
+            t1=obs[0].date_ordinal,
+            t2=obs[-1].date_ordinal,
+            p2=obs[-1].price,
+            optimized_intervals=[oi for _, oi in sorted(fitted_intervals.items()) if oi],
+            fit_stats=fit_stats,
+        )
+
+    def compute_sampled_t1_fits(self, args) -> IntervalFits:
+        """
+        compute_nested_fits on random starts, SAMPLED_T1_BATCH_SIZE at a time, until the bubble
+        confidences of the sample are within conf_max_error of the confidences over all starts,
+        or clearly above or below BUBBLE_THRESHOLD. See BubbleScores.get_conf_error.
+        """
+        obs, window_size, t1_index, starts, nested_seeding, warm_start_t1, previous_fits = args
+
+        # the same sample in every run
+        sampled_starts = list(self.filter.get_window_rng(obs, self.ticker).permutation(starts))
+        fit_stats = FitStats()
+        optimized_intervals: List[OptimizedInterval] = []
+        bubble_fits = []
+        sampled = 0
+        while sampled < len(starts):
+            batch = sorted(
+                int(j) for j in sampled_starts[sampled : sampled + SAMPLED_T1_BATCH_SIZE]
+            )
+            sampled += len(batch)
+            interval_fits = self.compute_nested_fits(
+                (obs, window_size, t1_index, batch, nested_seeding, warm_start_t1, previous_fits)
+            )
+            fit_stats.merge(interval_fits.fit_stats)
+            optimized_intervals += interval_fits.optimized_intervals
+            # should_optimize only stops at the first rejection reason, qualification is the same
+            bubble_fits += [
+                self.filter.check_bubble_fit(oi, self.observations, True)
+                for oi in interval_fits.optimized_intervals
+            ]
+
+            if sampled < SAMPLED_T1_MIN_WINDOWS:
+                continue
+            pos_qual_count, pos_count, neg_qual_count, neg_count = BubbleScores.count_bubble_fits(
+                bubble_fits
+            )
+            if all(
+                self.is_conf_known(qualified, count, sampled, len(starts))
+                for qualified, count in [(pos_qual_count, pos_count), (neg_qual_count, neg_count)]
+            ):
+                break
+
+        return IntervalFits(
+            t1=obs[0].date_ordinal,
+            t2=obs[-1].date_ordinal,
+            p2=obs[-1].price,
+            optimized_intervals=sorted(optimized_intervals, key=lambda oi: oi.t1_index),
+            fit_stats=fit_stats,
+            sampled_windows=sampled,
+            nested_windows=len(starts),
+        )
+
+    def is_conf_known(self, qualified: int, count: int, sampled: int, population: int) -> bool:
+        """
+        Whether a sampled confidence is precise enough, or at least clearly on one side of
+        BUBBLE_THRESHOLD.
+        """
+        error = BubbleScores.get_conf_error(qualified, count, sampled, population)
+        conf = qualified / count if count > 0 else 0
+        return error <= self.conf_max_error or abs(conf - BUBBLE_THRESHOLD) > error
+
+    def are_t1_fits_alike(
+        self, interval: OptimizedInterval | None, other_interval: OptimizedInterval | None
+    ) -> bool:
+        """
+        Whether two neighbouring nested fits would count the same in the bubble confidence, and
+        predict about the same tc.
+        """
+        if not interval or not other_interval:
+            return interval is other_interval
+
+        # should_optimize only stops at the first rejection reason, qualification is the same
+        bubble_fit = self.filter.check_bubble_fit(interval, self.observations, True)
+        other_bubble_fit = self.filter.check_bubble_fit(other_interval, self.observations, True)
+        tc_distance = abs(interval.optimized_params.tc - other_interval.optimized_params.tc)
+        return (
+            bubble_fit.type == other_bubble_fit.type
+            and bool(bubble_fit.rejection_reasons) == bool(other_bubble_fit.rejection_reasons)
+            and bool(tc_distance <= ADAPTIVE_T1_TC_TOLERANCE)
+        )
+
+    def compute_nested_fits(self, args) -> IntervalFits:
+        """
+        Fits the nested windows obs[j:window_size] of one t2 window, for the given starts j.
+        """
+        obs, window_size, t1_index, starts, nested_seeding, warm_start_t1, previous_fits = args
+
+        cache_keys: Dict[int, str] = {}
+        cached_fits: Dict[str, Tuple[OptimizedParams | None, int]] = {}
+        new_fits: Dict[str, Tuple[OptimizedParams | None, int]] = {}
+        if self.fit_cache:
+            if previous_fits is not None:
+                raise ValueError("Fits warm started from the previous t2 window can not be cached")
+            seed_policy = self.get_seed_policy(nested_seeding, warm_start_t1, window_size, starts)
+            config_fingerprint = self.filter.get_config_fingerprint()
+            for j in starts:
+                cache_keys[j] = FitCache.get_key(
+                    self.ticker, obs[j:window_size], config_fingerprint, seed_policy
+                )
+            cached_fits = self.fit_cache.get_many(list(cache_keys.values()))
+
+        all_cached = len(cached_fits) == len(starts)
+        nested_seeds = (
+            self.get_nested_seeds(obs, starts) if nested_seeding and not all_cached else {}
+        )
+
+        optimized_intervals: List[OptimizedInterval] = []
+        fit_stats = FitStats()
 
         t1 = obs[0].date_ordinal
         t2 = obs[-1].date_ordinal
         p2 = obs[-1].price
 
         # run n fits on the observation slice.
-        for j in range(0, window_delta, t1_increment):
+        for j in starts:
             obs_shrinking_slice = obs[j:window_size]
 
-            optimized_params = self.fit(obs_shrinking_slice)
+            window_stats = FitStats()
+            optimized_params = None
+            cache_key = cache_keys.get(j)
+            if cache_key in cached_fits:
+                optimized_params, searches = cached_fits[cache_key]
+                window_stats.cache_hits += 1
+            elif previous_fits and previous_fits.optimized_intervals:
+                warm_interval = min(
+                    previous_fits.optimized_intervals,
+                    key=lambda oi: abs(oi.t1_index - (t1_index + j)),
+                )
+                optimized_params = self.warm_start_fit(
+                    obs_shrinking_slice, warm_interval, window_stats
+                )
+
+            if not optimized_params and cache_key not in cached_fits:
+                warm_seed = None
+                if warm_start_t1 and optimized_intervals:
+                    warm_params = optimized_intervals[-1].optimized_params
+                    warm_seed = np.array([warm_params.tc, warm_params.m, warm_params.w])
+
+                optimized_params = self.fit(
+                    obs_shrinking_slice,
+                    seeds=nested_seeds.get(j),
+                    warm_seed=warm_seed,
+                    stats=window_stats,
+                )
+
+            if cache_key not in cached_fits:
+                searches = window_stats.searches
+                if cache_key:
+                    new_fits[cache_key] = (optimized_params, searches)
 
+            fit_stats.merge(window_stats)
             if not optimized_params:
                 continue
 
@@ -123,14 +703,167 @@ class DataFit(TypeCheckBase):
                 t1_index=nested_t1_index,
                 t2_index=nested_t2_index,
                 optimized_params=optimized_params,
+                searches=searches,
             )
 
             # Append updated params_dict to windows
             optimized_intervals.append(optimizedInterval)
 
+        if self.fit_cache:
+            self.fit_cache.put_many(new_fits)
+
         return IntervalFits(
             t1=t1,
             t2=t2,
             p2=p2,
             optimized_intervals=optimized_intervals,
+            fit_stats=fit_stats,
         )
+
+    def compute_t1_fits_batch(
+        self,
+        windows: List[ObservationSeries],
+        tickers: List[str],
+        t1_indexes: List[int],
+        window_size: int = LARGEST_WINDOW_SIZE,
+        smallest_window_size: int = SMALLEST_WINDOW_SIZE,
+        t1_increment: int = T1_STEP,
+        polish: bool = False,
+        stats: FitStats | None = None,
+    ) -> List[IntervalFits]:
+        """
+        compute_t1_fits for the t2 windows of many tickers at once. All windows have the same
+        geometry, so each nested t1 window of all tickers is fitted in one batch, see
+        FilterInterface.fit_batch. Only self.filter and the fit settings of this DataFit are used.
+        Args:
+            windows: The window_size observations of each ticker, all ending at their t2.
+            t1_indexes: Index of the first observation of each window in its ticker's series.
+            stats: Counters of the whole batch, they can not be split by ticker.
+        """
+        window_delta = window_size - smallest_window_size
+        optimized_intervals: List[List[OptimizedInterval]] = [[] for _ in windows]
+
+        for j in range(0, window_delta, t1_increment):
+            nested_windows = [obs[j:window_size] for obs in windows]
+            nested_fits = self.filter.fit_batch(
+                nested_windows, self.minimizer, tickers, polish, stats, self.coordinates
+            )
+            for b, (obs_shrinking_slice, optimized_params) in enumerate(
+                zip(nested_windows, nested_fits)
+            ):
+                if not optimized_params:
+                    continue
+
+                optimized_intervals[b].append(
+                    OptimizedInterval(
+                        t1=obs_shrinking_slice[0].date_ordinal,
+                        t2=obs_shrinking_slice[-1].date_ordinal,
+                        t1_index=t1_indexes[b] + j,
+                        t2_index=t1_indexes[b] + window_size,
+                        optimized_params=optimized_params,
+                        searches=1,
+                    )
+                )
+
+        return [
+            IntervalFits(
+                t1=obs[0].date_ordinal,
+                t2=obs[-1].date_ordinal,
+                p2=obs[-1].price,
+                optimized_intervals=intervals,
+            )
+            for obs, intervals in zip(windows, optimized_intervals)
+        ]
+
+    def get_seed_policy(
+        self,
+        nested_seeding: bool,
+        warm_start_t1: bool,
+        window_size: int,
+        starts: List[int],
+    ) -> str:
+        """
+        Everything a nested fit depends on besides its window and the filter config.
+        """
+        seed_policy = (
+            f"{self.strategy.value}|{self.restart_policy.value}|{self.minimizer}|"
+            f"{self.coordinates.value}|max_searches={self.max_searches}|"
+            f"tries_to_get_minimum={self.tries_to_get_minimum}|nested_seeding={nested_seeding}|"
+            f"warm_start_t1={warm_start_t1}"
+        )
+        if nested_seeding or warm_start_t1:
+            # the nested seeds come from a lattice on obs[starts[0]:window_size], and the warm
+            # seeds from the fits of the previous starts, which T1Stepping.ADAPTIVE fits in passes
+            seed_policy += (
+                f"|window_size={window_size}|starts={','.join(map(str, starts))}"
+                f"|t1_stepping={self.t1_stepping.value}"
+            )
+        return seed_policy
+
+    def warm_start_fit(
+        self,
+        observations: ObservationSeries,
+        warm_interval: OptimizedInterval,
+        stats: FitStats | None = None,
+    ) -> OptimizedParams | None:
+        """
+        A single local search seeded with the optimum of a neighbouring window.
+        Returns None when that optimum is outside this window's search bounds or when the new fit
+        is clearly worse than the one it started from. The window is then refitted cold, so only
+        the searches of a rejected warm start are added to stats, not a fit.
+        """
+        warm_params = warm_interval.optimized_params
+        seed = np.array([warm_params.tc, warm_params.m, warm_params.w])
+        lower_bounds, upper_bounds = zip(*self.filter.get_search_bounds(observations))
+        if np.any(seed < lower_bounds) or np.any(seed > upper_bounds):
+            return None
+
+        warm_stats = FitStats()
+        optimized_params = self.fit(
+            observations, seeds=[seed], max_searches=1, tries_to_get_minimum=1, stats=warm_stats
+        )
+        if optimized_params:
+            warm_observations = self.observations.get_between_indexes(
+                warm_interval.t1_index, warm_interval.t2_index
+            )
+            warm_ssr = LPPLSMath.sum_of_squared_residuals(warm_observations, warm_params)
+            ssr = LPPLSMath.sum_of_squared_residuals(observations, optimized_params)
+            if ssr > WARM_START_MAX_SSR_RATIO * warm_ssr:
+                optimized_params = None
+
+        if not optimized_params:
+            warm_stats.fits = warm_stats.failed_fits = warm_stats.exhausted_fits = 0
+        if stats is not None:
+            stats.merge(warm_stats)
+        return optimized_params
+
+    def get_nested_seeds(
+        self, obs: ObservationSeries, starts: List[int]
+    ) -> Dict[int, List[np.ndarray]]:
+        """
+        Scores one (tc, m, w) lattice on all the nested windows obs[j:] at once and returns, for
+        each start j, the best lattice cells that lie within that window's search bounds.
+        """
+        if not starts:
+            return {}
+
+        lattice = self.filter.get_search_lattice(
+            self.filter.get_search_bounds(obs[starts[0] :]),
+            (NESTED_SEED_TC_GRID_SIZE, NESTED_SEED_M_GRID_SIZE, NESTED_SEED_W_GRID_SIZE),
+        )
+        costs = LPPLSMath.nested_squared_residuals(
+            lattice,
+            np.asarray(obs.get_date_ordinals(), dtype=float),
+            obs.get_log_prices(),
+            np.array(starts),
+        )
+
+        nested_seeds = {}
+        for index, j in enumerate(starts):
+            # smaller windows allow a smaller tc
+            _, tc_max = self.filter.get_search_bounds(obs[j:])[0]
+            window_costs = np.where(lattice[:, 0] <= tc_max, costs[:, index], SINGULAR_FIT_COST)
+            best = np.argsort(window_costs)[:NESTED_SEEDS_PER_WINDOW]
+            nested_seeds[j] = [lattice[k] for k in best if window_costs[k] < SINGULAR_FIT_COST]
+
+        return nested_seeds
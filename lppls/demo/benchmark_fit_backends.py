@@ -0,0 +1,261 @@
+import argparse
+import csv
+import time
+import warnings
+from typing import List, Tuple
+import numpy as np
+from lppls.data_fit import DataFit
+from lppls.bubble_scores import BubbleScores
+from lppls.filter_bitcoin2019B import FilterBitcoin2019B
+from lppls.fit_backends import FIT_BACKENDS, DEFAULT_FIT_BACKEND, get_fit_backend
+from lppls.lppls_math import LPPLSMath
+from lppls.lppls_defaults import LARGEST_WINDOW_SIZE, SMALLEST_WINDOW_SIZE, T1_STEP
+from lppls.lppls_dataclasses import (
+    FitStats,
+    Observation,
+    ObservationSeries,
+    OptimizedParams,
+)
+from common.typechecking import TypeCheckBase
+
+# Convert warnings to exceptions, like the daily run does
+warnings.filterwarnings("error", category=RuntimeWarning)
+
+
+FILTER_FILE = "./lppls/conf/demos2015_filter.json"
+CORPUS_START_DATE_ORDINAL = 738000
+# (days from the last observation to tc, m, w, b, c / b, noise): the same windows on every run
+CORPUS = [
+    (10, 0.7, 9.0, -0.05, 0.055, 0.005),
+    (20, 0.7, 9.0, -0.05, 0.055, 0.01),
+    (40, 0.5, 7.0, -0.08, 0.06, 0.01),
+    (15, 0.3, 11.0, -0.2, 0.05, 0.02),
+    (20, 0.7, 9.0, 0.05, 0.055, 0.01),
+    (30, 0.5, 8.0, 0.08, 0.06, 0.02),
+    # no bubble at all, only noise around a trend
+    (20, 0.5, 9.0, 0.0, 0.0, 0.01),
+]
+CSV_COLUMN_NAMES = [
+    "Backend",
+    "Wall time (s)",
+    "Evaluations",
+    "Success rate",
+    "Mean SSR",
+    "Mean confidence",
+    "Max confidence change",
+]
+
+# One row of CSV_COLUMN_NAMES
+BenchmarkRow = Tuple[str, float, float, float, float, float, float]
+
+
+class FitBackendsBenchmark(TypeCheckBase):
+    """
+    Runs every fit backend on the nested t1 windows of a fixed corpus of synthetic LPPLS windows,
+    so that backends can be compared on speed without trading away fit quality or confidence.
+    """
+
+    def __init__(self, filter_file: str = FILTER_FILE):
+        self.filter = FilterBitcoin2019B(filter_file)
+        self.corpus = [self.get_corpus_window(i) for i in range(len(CORPUS))]
+
+    def get_corpus_window(self, index: int) -> ObservationSeries:
+        tc_offset, m, w, b, c_b_ratio, noise = CORPUS[index]
+        date_ordinals = np.arange(
+            CORPUS_START_DATE_ORDINAL, CORPUS_START_DATE_ORDINAL + LARGEST_WINDOW_SIZE
+        )
+        c1, c2 = 0.8 * c_b_ratio * b, 0.6 * c_b_ratio * b
+        op = OptimizedParams(float(date_ordinals[-1] + tc_offset), m, w, 5.0, b, c1, c2)
+        rng = np.random.default_rng(index)
+        log_prices = LPPLSMath.predict_log_prices(date_ordinals, op)
+        log_prices += noise * rng.standard_normal(len(date_ordinals))
+        return ObservationSeries(
+            [
+                Observation(price=float(np.exp(log_price)), date_ordinal=int(date_ordinal))
+                for date_ordinal, log_price in zip(date_ordinals, log_prices)
+            ]
+        )
+
+    def benchmark_backend(self, name: str) -> List[float]:
+        """
+        Returns:
+            The wall time, cost evaluations, share of successful fits, mean SSR and the
+            bubble confidence of each corpus window.
+        """
+        backend = get_fit_backend(name)
+        fit_stats = FitStats()
+        wall_time = 0.0
+        ssrs, confidences = [], []
+
+        for index, observations in enumerate(self.corpus):
+            data_fit = DataFit(
+                observations,
+                self.filter,
+                backend.strategy,
+                ticker=f"corpus{index}",
+                minimizer=backend.minimizer,
+                coordinates=backend.coordinates,
+            )
+            args = (
+                observations,
+                LARGEST_WINDOW_SIZE,
+                0,
+                SMALLEST_WINDOW_SIZE,
+                T1_STEP,
+                False,
+                False,
+                None,
+            )
+            start = time.perf_counter()
+            interval_fits = data_fit.compute_t1_fits(args)
+            wall_time += time.perf_counter() - start
+            fit_stats.merge(interval_fits.fit_stats)
+
+            for oi in interval_fits.optimized_intervals:
+                nested_observations = observations.get_between_indexes(oi.t1_index, oi.t2_index)
+                ssrs.append(
+                    LPPLSMath.sum_of_squared_residuals(nested_observations, oi.optimized_params)
+                )
+
+            bubble_score = BubbleScores(observations, self.filter).compute_bubble_scores(
+                [interval_fits], should_optimize=False
+            )[0]
+            # the confidence in the bubble that is there, or in any bubble if there is none
+            _, _, _, b, _, _ = CORPUS[index]
+            if b < 0:
+                confidences.append(bubble_score.pos_conf)
+            elif b > 0:
+                confidences.append(bubble_score.neg_conf)
+            else:
+                confidences.append(max(bubble_score.pos_conf, bubble_score.neg_conf))
+
+        success_rate = 1 - fit_stats.failed_fits / fit_stats.fits if fit_stats.fits else 0.0
+        mean_ssr = float(np.mean(ssrs)) if ssrs else np.nan
+        return [wall_time, fit_stats.evaluations, success_rate, mean_ssr, *confidences]
+
+    def benchmark_batch(self) -> None:
+        """
+        Fits the nested t1 windows of all corpus windows together with
+        DataFit.compute_t1_fits_batch, and checks that every window gets the same fit as the
+        differential-evolution backend gives it alone.
+        """
+        backend = get_fit_backend("differential-evolution")
+        tickers = [f"corpus{index}" for index in range(len(self.corpus))]
+        data_fits = [
+            DataFit(
+                observations,
+                self.filter,
+                backend.strategy,
+                ticker=ticker,
+                minimizer=backend.minimizer,
+                coordinates=backend.coordinates,
+            )
+            for observations, ticker in zip(self.corpus, tickers)
+        ]
+
+        start = time.perf_counter()
+        batch_fits = data_fits[0].compute_t1_fits_batch(
+            self.corpus, tickers, [0] * len(self.corpus), polish=True
+        )
+        batch_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        window_fits = [
+            data_fit.compute_t1_fits(
+                (
+                    observations,
+                    LARGEST_WINDOW_SIZE,
+                    0,
+                    SMALLEST_WINDOW_SIZE,
+                    T1_STEP,
+                    False,
+                    False,
+                    None,
+                )
+            )
+            for data_fit, observations in zip(data_fits, self.corpus)
+        ]
+        window_time = time.perf_counter() - start
+
+        fits, equal_fits = 0, 0
+        for batch_interval_fits, interval_fits in zip(batch_fits, window_fits):
+            window_params = {
+                oi.t1_index: oi.optimized_params for oi in interval_fits.optimized_intervals
+            }
+            for oi in batch_interval_fits.optimized_intervals:
+                fits += 1
+                equal_fits += int(window_params.get(oi.t1_index) == oi.optimized_params)
+        print(
+            f"Batched {backend.strategy.value}: {batch_time:.2f}s against {window_time:.2f}s "
+            f"window by window, {equal_fits}/{fits} nested fits equal"
+        )
+
+    def run(self, names: List[str], csv_file: str | None = None) -> None:
+        results = {name: self.benchmark_backend(name) for name in names}
+        reference = results.get(DEFAULT_FIT_BACKEND, next(iter(results.values())))
+        reference_confidences = np.array(reference[4:])
+
+        rows: List[BenchmarkRow] = []
+        for name, result in results.items():
+            wall_time, evaluations, success_rate, mean_ssr = result[:4]
+            confidences = np.array(result[4:])
+            confidence_change = float(np.max(np.abs(confidences - reference_confidences)))
+            rows.append(
+                (
+                    name,
+                    wall_time,
+                    evaluations,
+                    success_rate,
+                    mean_ssr,
+                    float(np.mean(confidences)),
+                    confidence_change,
+                )
+            )
+
+        print(" | ".join(CSV_COLUMN_NAMES))
+        for row in rows:
+            name, wall_time, evaluations, success_rate, mean_ssr, confidence, change = row
+            print(
+                f"{name} | {wall_time:.2f} | {evaluations} | {success_rate:.2%} | {mean_ssr:.3e} | "
+                f"{confidence:.3f} | {change:.3f}"
+            )
+
+        if csv_file:
+            with open(csv_file, "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(CSV_COLUMN_NAMES)
+                writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the fit backends on a fixed corpus.")
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=list(FIT_BACKENDS),
+        default=list(FIT_BACKENDS),
+        help="Backends to run, all of them by default.",
+    )
+    parser.add_argument("--filter-file", default=FILTER_FILE, help="Filter configuration.")
+    parser.add_argument("--csv", help="Also write the results to this CSV file.")
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Also fit the corpus in one batch and check it against the window by window fits.",
+    )
+    args = parser.parse_args()
+
+    benchmark = FitBackendsBenchmark(args.filter_file)
+    benchmark.run(args.backends, args.csv)
+    if args.batch:
+        benchmark.benchmark_batch()
+
+
+# To compare all backends:
+# python -m lppls.demo.benchmark_fit_backends
+
+# To also check the cross-ticker batch against the differential-evolution backend:
+# python -m lppls.demo.benchmark_fit_backends --backends differential-evolution --batch
+
+# To compare a few of them and keep the numbers:
+# python -m lppls.demo.benchmark_fit_backends --backends nelder-mead trf tc-profile --csv backends.csv
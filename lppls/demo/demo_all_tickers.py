@@ -1,6 +1,7 @@
 import csv
 import psycopg2
 from lppls.sornette import Sornette
+from lppls.fit_cache import FitCache
 from lppls.lppls_defaults import (
     LARGEST_WINDOW_SIZE,
     SMALLEST_WINDOW_SIZE,
@@ -8,12 +9,20 @@ from lppls.lppls_defaults import (
     T2_STEP,
     OPTIMIZE_T1_STEP,
     RECENT_VISIBLE_WINDOWS,
-    BUBBLE_THRESHOLD
+    BUBBLE_THRESHOLD,
+    FIT_CACHE_FILE,
 )
 import argparse
 from matplotlib import pyplot as plt
 import os
-from lppls.lppls_dataclasses import BubbleScore, BubbleType, Observation, ObservationSeries
+from dataclasses import asdict, fields
+from lppls.lppls_dataclasses import (
+    BubbleScore,
+    BubbleType,
+    FitStats,
+    Observation,
+    ObservationSeries,
+)
 from lppls.bubble_bounds.peaks import Peaks
 import warnings
 from lppls.bubble_bounds.pop_dates import PopDates
@@ -22,7 +31,7 @@ from prices_db_management.db_dataclasses import Suggestion, OrderType
 from common.typechecking import TypeCheckBase
 from common.date_utils import DateUtils as du
 from prices_db_management.db_defaults import DB_HOST, DB_NAME, DB_USER, DB_PASSWORD, DB_PORT
-from typing import List
+from typing import Dict, List
 import cProfile
 
 # Convert warnings to exceptions
@@ -45,10 +54,19 @@ CSV_COLUMN_NAMES = [
     "Silhoutte",
 ]
 
+# The work of the fits of each ticker, and of the whole run in the last row
+FIT_STATS_COLUMN_NAMES = ["Ticker"] + [f.name for f in fields(FitStats)]
+FIT_STATS_RUN_ROW = "ALL"
+
 DEFAULT_BACKTEST_DAYS_BACK_LPPLS = 40
 
 
 class AllTickers(TypeCheckBase):
+    def __init__(self, fit_cache: FitCache | None = None, bootstrap_tc: bool = False):
+        self.fit_cache = fit_cache
+        # pop dates from the bootstrap distribution of tc instead of the cluster centers
+        self.bootstrap_tc = bootstrap_tc
+
     def get_connection(self):
         return psycopg2.connect(
             host=DB_HOST,
@@ -76,8 +94,16 @@ class AllTickers(TypeCheckBase):
         filter_type: str,
         filter_file: str,
         should_optimize: bool,
+        ticker: str = "",
     ) -> tuple[BubbleType | None, List[float], Sornette]:
-        sornette = Sornette(observations, filter_type, filter_file, should_optimize)
+        sornette = Sornette(
+            observations,
+            filter_type,
+            filter_file,
+            should_optimize,
+            ticker=ticker,
+            fit_cache=self.fit_cache,
+        )
 
         relevant_windows = 1 if should_optimize else RECENT_RELEVANT_WINDOWS
         t1_step = T1_STEP if should_optimize else OPTIMIZE_T1_STEP
@@ -110,6 +136,7 @@ class AllTickers(TypeCheckBase):
                 "BitcoinB",
                 "./lppls/conf/demos2015_filter.json",
                 should_optimize=True,
+                ticker=ticker,
             )
             if not bubble_type:
                 continue
@@ -121,8 +148,17 @@ class AllTickers(TypeCheckBase):
                 bubble_type,
                 drawups if bubble_type == BubbleType.POSITIVE else drawdowns,
             )
-            sornette.plot_fit(bubble_start)
             bubble_scores = self.get_bubble_scores(sornette, 50, T1_STEP)
+            # plot the largest qualified fit of the latest window instead of fitting again
+            qualified_intervals = [
+                oi
+                for oi in PopDates().get_qualified_intervals(bubble_start, bubble_scores, test_date)
+                if oi.bubble_fit.type == bubble_type
+            ]
+            optimized_interval = min(
+                qualified_intervals, key=lambda oi: (-oi.t2, oi.t1), default=None
+            )
+            sornette.plot_fit(bubble_start, optimized_interval=optimized_interval)
             best_end_cluster = PopDates().compute_bubble_end_cluster(
                 bubble_start, bubble_scores, test_date
             )
@@ -154,6 +190,7 @@ class AllTickers(TypeCheckBase):
         positive_bubbles, negative_bubbles = [], []
         bubble_assets = []
         suggestions = []
+        ticker_fit_stats: Dict[str, FitStats] = {}
 
         daily_plots_dir_path = os.path.join(PLOTS_DIR, test_date)
         if not os.path.exists(daily_plots_dir_path):
@@ -180,8 +217,14 @@ class AllTickers(TypeCheckBase):
             )
 
             bubble_type, bubble_confidences, sornette = self.is_in_bubble_state(
-                observations, "BitcoinB", "./lppls/conf/demos2015_filter.json", should_optimize
+                observations,
+                "BitcoinB",
+                "./lppls/conf/demos2015_filter.json",
+                should_optimize,
+                ticker=ticker,
             )
+            # the same object keeps counting the fits of this ticker below
+            ticker_fit_stats[ticker] = sornette.data_fit.fit_stats
 
             if not bubble_type:
                 continue
@@ -261,6 +304,17 @@ class AllTickers(TypeCheckBase):
 
             # Make trading suggestions to the databse used for backtesting.
             pop_dates_range = best_end_cluster.give_pop_dates_range(test_date)
+            if self.bootstrap_tc:
+                tc_distribution = PopDates().compute_tc_distribution(
+                    sornette.data_fit.observations,
+                    sornette.data_fit.filter,
+                    start_time,
+                    bubble_scores,
+                    test_date,
+                    ticker=ticker,
+                )
+                print(tc_distribution.displayDistribution())
+                pop_dates_range = tc_distribution.give_pop_dates_range(test_date)
             order_type = OrderType.SELL if bubble_type == BubbleType.POSITIVE else OrderType.BUY
 
             if pop_dates_range:
@@ -284,6 +338,22 @@ class AllTickers(TypeCheckBase):
             for asset in bubble_assets:
                 writer.writerow(asset)
 
+        self.write_fit_stats(ticker_fit_stats, daily_plots_dir_path)
+
+    def write_fit_stats(self, ticker_fit_stats: Dict[str, FitStats], dir_path: str) -> None:
+        run_fit_stats = FitStats()
+        for fit_stats in ticker_fit_stats.values():
+            run_fit_stats.merge(fit_stats)
+        print(run_fit_stats.summary())
+
+        csv_file_path = os.path.join(dir_path, "fit_stats.csv")
+        with open(csv_file_path, mode="w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=FIT_STATS_COLUMN_NAMES)
+            writer.writeheader()
+            for ticker, fit_stats in ticker_fit_stats.items():
+                writer.writerow({FIT_STATS_COLUMN_NAMES[0]: ticker, **asdict(fit_stats)})
+            writer.writerow({FIT_STATS_COLUMN_NAMES[0]: FIT_STATS_RUN_ROW, **asdict(run_fit_stats)})
+
     def backtest(self, backtest_start: int, backtest_end: int) -> None:
         for i in range(backtest_start, backtest_end, -1):
             test_date = du.days_ago(i)
@@ -320,6 +390,18 @@ if __name__ == "__main__":
     )
     parser.add_argument("--specific", action="store_true", help="Plot only specific stocks")
     parser.add_argument("--profile", action="store_true", help="Enable profiling")
+    parser.add_argument(
+        "--fit-cache",
+        nargs="?",
+        help="Reuse the fits of previous runs, kept in this sqlite file.",
+        const=FIT_CACHE_FILE,
+        default=None,
+    )
+    parser.add_argument(
+        "--bootstrap-tc",
+        action="store_true",
+        help="Take the pop dates of the suggestions from a bootstrap of tc, not the clusters.",
+    )
 
     # Parse the arguments
     args = parser.parse_args()
@@ -328,7 +410,9 @@ if __name__ == "__main__":
     if args.backtest_end != -1 and args.backtest_start == -1:
         parser.error("When specifying --backtest-end, you must also specify --backtest-start.")
 
-    all_tickers = AllTickers()
+    all_tickers = AllTickers(
+        FitCache(args.fit_cache) if args.fit_cache else None, bootstrap_tc=args.bootstrap_tc
+    )
 
     # Check if backtest argument is provided
     if args.profile:
@@ -347,5 +431,11 @@ if __name__ == "__main__":
 # To backtest:
 # python demo_all_tickers.py --backtest-start 95
 
+# To reuse the fits of previous days while backtesting:
+# python demo_all_tickers.py --backtest-start 200 --fit-cache
+
+# To suggest the pop dates from a bootstrap of tc, which takes longer:
+# python demo_all_tickers.py --backtest-start 95 --bootstrap-tc
+
 # To backtest with range:
 # python demo_all_tickers.py --backtest-start 95 --backtest-end 90
@@ -0,0 +1,292 @@
+import argparse
+import csv
+import itertools
+import time
+import warnings
+from multiprocessing import Pool
+from typing import Dict, List, Tuple
+import psycopg2
+from lppls.data_fit import DataFit
+from lppls.bubble_scores import BubbleScores
+from lppls.bubble_bounds.pop_dates import PopDates
+from lppls.filter_bitcoin2019B import FilterBitcoin2019B
+from lppls.lppls_defaults import (
+    LARGEST_WINDOW_SIZE,
+    SMALLEST_WINDOW_SIZE,
+    MAX_SEARCHES,
+    TRIES_TO_GET_MINIMUM,
+    T1_STEP,
+    T2_STEP,
+    BUBBLE_THRESHOLD,
+)
+from lppls.lppls_dataclasses import (
+    BubbleStart,
+    BubbleType,
+    FitBudget,
+    Observation,
+    ObservationSeries,
+)
+from prices_db_management.db_defaults import DB_HOST, DB_NAME, DB_USER, DB_PASSWORD, DB_PORT
+from common.typechecking import TypeCheckBase
+
+# Convert warnings to exceptions, like the daily run does
+warnings.filterwarnings("error", category=RuntimeWarning)
+
+
+FILTER_FILE = "./lppls/conf/demos2015_filter.json"
+# (ticker, test date) pairs replayed under every budget, the same on every run
+CORPUS = [
+    ("TSLA", "2021-11-05"),
+    ("NVDA", "2024-03-08"),
+    ("AAPL", "2023-07-31"),
+    ("SPY", "2022-01-04"),
+    ("QQQ", "2021-11-22"),
+    ("XLE", "2022-06-09"),
+]
+# t2 windows replayed before each test date, as many as demo_all_tickers screens
+RECENT_WINDOWS = 5
+# fits of the reference are what the other budgets are compared to
+REFERENCE_BUDGET = FitBudget(
+    max_searches=2 * MAX_SEARCHES, tries_to_get_minimum=5, t1_increment=1, t2_increment=1
+)
+MAX_SEARCHES_GRID = [5, 10, 15, MAX_SEARCHES]
+TRIES_TO_GET_MINIMUM_GRID = [1, 2, TRIES_TO_GET_MINIMUM]
+T1_STEP_GRID = [1, T1_STEP, 4]
+T2_STEP_GRID = [T2_STEP, 2]
+CSV_COLUMN_NAMES = [
+    "Max searches",
+    "Tries to get minimum",
+    "T1 step",
+    "T2 step",
+    "Fit time (s)",
+    "Max confidence change",
+    "Max pop dates change (days)",
+    "Flag changes",
+    "Pareto",
+]
+
+# Fit time, the bubble confidences by t2 and the mean pop dates of the best end cluster
+Replay = Tuple[float, Dict[int, Tuple[float, float]], List[int]]
+
+
+class FitBudgetTuner(TypeCheckBase):
+    """
+    Replays a fixed corpus of tickers and test dates under many fit budgets, and compares the
+    time each one takes to how much it moves the bubble confidences, the pop dates and the
+    flagged tickers away from a high budget reference.
+    """
+
+    def __init__(
+        self, corpus: List[Tuple[str, str, ObservationSeries]], filter_file: str = FILTER_FILE
+    ):
+        """
+        Args:
+            corpus: The ticker, test date and observations before that date of every replay.
+        """
+        self.corpus = corpus
+        self.filter = FilterBitcoin2019B(filter_file)
+
+    @staticmethod
+    def load_corpus(pairs: List[Tuple[str, str]]) -> List[Tuple[str, str, ObservationSeries]]:
+        conn = psycopg2.connect(
+            host=DB_HOST,
+            database=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            port=DB_PORT,
+        )
+        cursor = conn.cursor()
+
+        corpus = []
+        for ticker, test_date in pairs:
+            # Never select the test date - the daily run happens before the market opens
+            query = f"SELECT date, close_price FROM pricing_history WHERE ticker='{ticker}' AND date < '{test_date}' ORDER BY date ASC;"
+            cursor.execute(query)
+            rows = cursor.fetchall()
+            observations = ObservationSeries(
+                [Observation(price=row[1], date_ordinal=row[0].toordinal()) for row in rows]
+            )
+            if len(observations) < LARGEST_WINDOW_SIZE + RECENT_WINDOWS:
+                print(f"Skipping {ticker} because it has too few observations.")
+                continue
+            corpus.append((ticker, test_date, observations))
+        return corpus
+
+    def replay(self, args: Tuple[FitBudget, int]) -> Replay:
+        budget, index = args
+        ticker, test_date, observations = self.corpus[index]
+        data_fit = DataFit(
+            observations,
+            self.filter,
+            ticker=ticker,
+            max_searches=budget.max_searches,
+            tries_to_get_minimum=budget.tries_to_get_minimum,
+        )
+
+        # CPU time of this process only, so that the workers do not slow each other's clocks
+        start = time.process_time()
+        all_fits = [
+            data_fit.compute_t1_fits(t2_fits_args)
+            for t2_fits_args in data_fit.get_t2_fits_args(
+                RECENT_WINDOWS,
+                LARGEST_WINDOW_SIZE,
+                SMALLEST_WINDOW_SIZE,
+                budget.t1_increment,
+                budget.t2_increment,
+                False,
+                False,
+            )
+        ]
+        fit_seconds = time.process_time() - start
+
+        bubble_scores = BubbleScores(observations, self.filter).compute_bubble_scores(
+            all_fits, should_optimize=False
+        )
+        confidences = {bs.t2: (bs.pos_conf, bs.neg_conf) for bs in bubble_scores}
+        # no bubble start, every qualified fit of the last days counts
+        start_time = BubbleStart(observations[0].date_ordinal, BubbleType.POSITIVE)
+        cluster = PopDates().compute_bubble_end_cluster(start_time, bubble_scores, test_date)
+        return fit_seconds, confidences, cluster.mean_pop_dates
+
+    @staticmethod
+    def get_flag(confidences: Dict[int, Tuple[float, float]]) -> BubbleType | None:
+        """
+        The bubble demo_all_tickers would flag, see AllTickers.is_in_bubble_state.
+        """
+        if max(pos_conf for pos_conf, _ in confidences.values()) > BUBBLE_THRESHOLD:
+            return BubbleType.POSITIVE
+        if max(neg_conf for _, neg_conf in confidences.values()) > BUBBLE_THRESHOLD:
+            return BubbleType.NEGATIVE
+        return None
+
+    @staticmethod
+    def get_pop_dates_change(pop_dates: List[int], reference_pop_dates: List[int]) -> float:
+        if not pop_dates and not reference_pop_dates:
+            return 0.0
+        if not pop_dates or not reference_pop_dates:
+            return float("inf")
+        return float(
+            max(
+                abs(pop_dates[0] - reference_pop_dates[0]),
+                abs(pop_dates[-1] - reference_pop_dates[-1]),
+            )
+        )
+
+    def compare(self, replays: List[Replay], reference_replays: List[Replay]) -> List[float]:
+        """
+        Returns:
+            The fit time, largest confidence change on the t2 windows both have, largest pop date
+            change and number of corpus entries flagged differently.
+        """
+        fit_seconds, confidence_change, pop_dates_change, flag_changes = 0.0, 0.0, 0.0, 0
+        for replay, reference_replay in zip(replays, reference_replays):
+            seconds, confidences, pop_dates = replay
+            _, reference_confidences, reference_pop_dates = reference_replay
+            fit_seconds += seconds
+            for t2, (pos_conf, neg_conf) in confidences.items():
+                if t2 in reference_confidences:
+                    reference_pos_conf, reference_neg_conf = reference_confidences[t2]
+                    confidence_change = max(
+                        confidence_change,
+                        abs(pos_conf - reference_pos_conf),
+                        abs(neg_conf - reference_neg_conf),
+                    )
+            pop_dates_change = max(
+                pop_dates_change, self.get_pop_dates_change(pop_dates, reference_pop_dates)
+            )
+            flag_changes += int(self.get_flag(confidences) != self.get_flag(reference_confidences))
+        return [fit_seconds, confidence_change, pop_dates_change, flag_changes]
+
+    @staticmethod
+    def get_pareto_front(results: List[List[float]]) -> List[bool]:
+        """
+        Whether each result is not dominated: no other one is at least as good on every measure
+        and better on one. All measures are to be minimized.
+        """
+        return [
+            not any(
+                all(o <= r for o, r in zip(other, result))
+                and any(o < r for o, r in zip(other, result))
+                for other in results
+            )
+            for result in results
+        ]
+
+    def run(self, budgets: List[FitBudget], workers: int, csv_file: str | None = None) -> None:
+        all_budgets = [REFERENCE_BUDGET] + budgets
+        tasks = [(budget, index) for budget in all_budgets for index in range(len(self.corpus))]
+        with Pool(processes=workers) as pool:
+            all_replays = pool.map(self.replay, tasks)
+
+        replays_by_budget = [
+            all_replays[i : i + len(self.corpus)] for i in range(0, len(tasks), len(self.corpus))
+        ]
+        reference_replays = replays_by_budget[0]
+        results = [self.compare(replays, reference_replays) for replays in replays_by_budget[1:]]
+        pareto = self.get_pareto_front(results)
+
+        rows = [
+            [
+                budget.max_searches,
+                budget.tries_to_get_minimum,
+                budget.t1_increment,
+                budget.t2_increment,
+                *result,
+                is_pareto,
+            ]
+            for budget, result, is_pareto in zip(budgets, results, pareto)
+        ]
+        rows.sort(key=lambda row: row[4])
+
+        reference_seconds = sum(seconds for seconds, _, _ in reference_replays)
+        print(f"Reference {REFERENCE_BUDGET}: {reference_seconds:.1f}s")
+        print(" | ".join(CSV_COLUMN_NAMES))
+        for row in rows:
+            seconds, confidence_change, pop_dates_change, flag_changes, is_pareto = row[4:]
+            print(
+                f"{' | '.join(map(str, row[:4]))} | {seconds:.1f} | {confidence_change:.3f} | "
+                f"{pop_dates_change:.0f} | {flag_changes} | {'*' if is_pareto else ''}"
+            )
+
+        unchanged_flags = [row for row in rows if row[7] == 0]
+        if unchanged_flags:
+            print(f"Cheapest budget that flags the same tickers: {unchanged_flags[0][:4]}")
+
+        if csv_file:
+            with open(csv_file, "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(CSV_COLUMN_NAMES)
+                writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare fit budgets on a fixed corpus, against a high budget reference."
+    )
+    parser.add_argument("--max-searches", type=int, nargs="+", default=MAX_SEARCHES_GRID)
+    parser.add_argument(
+        "--tries-to-get-minimum", type=int, nargs="+", default=TRIES_TO_GET_MINIMUM_GRID
+    )
+    parser.add_argument("--t1-steps", type=int, nargs="+", default=T1_STEP_GRID)
+    parser.add_argument("--t2-steps", type=int, nargs="+", default=T2_STEP_GRID)
+    parser.add_argument("--workers", type=int, default=8, help="Replays run in parallel.")
+    parser.add_argument("--filter-file", default=FILTER_FILE, help="Filter configuration.")
+    parser.add_argument("--csv", help="Also write the results to this CSV file.")
+    args = parser.parse_args()
+
+    budgets = [
+        FitBudget(max_searches, tries_to_get_minimum, t1_increment, t2_increment)
+        for max_searches, tries_to_get_minimum, t1_increment, t2_increment in itertools.product(
+            args.max_searches, args.tries_to_get_minimum, args.t1_steps, args.t2_steps
+        )
+        if tries_to_get_minimum <= max_searches
+    ]
+    corpus = FitBudgetTuner.load_corpus(CORPUS)
+    FitBudgetTuner(corpus, args.filter_file).run(budgets, args.workers, args.csv)
+
+
+# To compare the default grid of budgets:
+# python -m lppls.demo.tune_fit_budget
+
+# To compare a few budgets and keep the numbers:
+# python -m lppls.demo.tune_fit_budget --max-searches 10 25 --tries-to-get-minimum 2 3 --csv budgets.csv
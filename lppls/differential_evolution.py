@@ -0,0 +1,145 @@
+from typing import List, Tuple
+import numpy as np
+from lppls.lppls_math import LPPLSMath, SINGULAR_FIT_COST
+from lppls.lppls_defaults import (
+    DE_POPULATION_SIZE,
+    DE_MAX_GENERATIONS,
+    DE_MUTATION,
+    DE_CROSSOVER,
+    DE_TOLERANCE,
+)
+from common.typechecking import TypeCheckBase
+
+
+# Differential evolution (DE/rand/1/bin), as in:
+# Differential Evolution - A Simple and Efficient Heuristic for Global Optimization over
+# Continuous Spaces (1997)
+# Authors: R. Storn, K. Price
+#
+# A global search over (tc, m, w) that does not depend on a few lucky seeds. Every generation is
+# scored with a single batch_squared_residuals call, so the whole search costs about as much as a
+# few Nelder-Mead runs.
+#
+# Several windows of the same length, for instance the same window of many tickers, evolve together
+# as one batch: the arrays get a leading window axis and the Python overhead is paid once.
+# Each window draws from its own random stream, so its fit does not depend on the rest of the batch.
+class DifferentialEvolution(TypeCheckBase):
+    def __init__(
+        self,
+        search_bounds: List[Tuple[float, float]] | np.ndarray,
+        rng: np.random.Generator | List[np.random.Generator],
+    ):
+        """
+        Args:
+            search_bounds: (tc, m, w) bounds of shape (3, 2), or (B, 3, 2) for a batch of B windows.
+            rng: The random stream of each window, or of the only window.
+        """
+        bounds = np.array(search_bounds, dtype=float)
+        # always (B, 1, 3) lower and upper bounds, to broadcast against (B, P, 3) populations
+        bounds = bounds if bounds.ndim == 3 else bounds[None]
+        self.lower, self.upper = bounds[:, None, :, 0], bounds[:, None, :, 1]
+        self.rngs = rng if isinstance(rng, list) else [rng]
+        if len(self.rngs) != len(bounds):
+            raise ValueError("Every window needs its own random stream")
+        # cost function evaluations, one per member of every scored generation
+        self.evaluations = 0
+
+    def random(self, windows_indexes: np.ndarray, shape: Tuple[int, ...]) -> np.ndarray:
+        """
+        Uniform draws of the given shape for each window, stacked along a leading window axis.
+        """
+        return np.stack([self.rngs[b].random(shape) for b in windows_indexes])
+
+    def get_initial_population(self, seeds: List[List[np.ndarray]]) -> np.ndarray:
+        windows, _, dimensions = self.lower.shape
+        draws = self.random(np.arange(windows), (DE_POPULATION_SIZE, dimensions))
+        population = self.lower + draws * (self.upper - self.lower)
+        # seeds, like a warm start, replace the first random members
+        for b, window_seeds in enumerate(seeds):
+            for i, seed in enumerate(window_seeds[:DE_POPULATION_SIZE]):
+                population[b, i] = np.clip(seed, self.lower[b, 0], self.upper[b, 0])
+        return population
+
+    def score(
+        self, population: np.ndarray, date_ordinals: np.ndarray, log_prices: np.ndarray
+    ) -> np.ndarray:
+        self.evaluations += population.shape[0] * population.shape[1]
+        return LPPLSMath.batch_squared_residuals(population, date_ordinals, log_prices)
+
+    def get_trials(self, population: np.ndarray, windows_indexes: np.ndarray) -> np.ndarray:
+        windows, size, dimensions = population.shape
+        lower, upper = self.lower[windows_indexes], self.upper[windows_indexes]
+
+        # three distinct members, all different from the target member
+        draws = self.random(windows_indexes, (size, size))
+        draws[:, np.arange(size), np.arange(size)] = np.inf
+        others = np.argsort(draws, axis=-1)[..., :3]
+        base, first, second = (
+            np.take_along_axis(population, others[..., k : k + 1], axis=1) for k in range(3)
+        )
+        mutants = base + DE_MUTATION * (first - second)
+        # out of bounds components restart between the base member and the bound they crossed
+        mutants = np.where(
+            mutants < lower,
+            lower + self.random(windows_indexes, (size, dimensions)) * (base - lower),
+            mutants,
+        )
+        mutants = np.where(
+            mutants > upper,
+            upper - self.random(windows_indexes, (size, dimensions)) * (upper - base),
+            mutants,
+        )
+
+        crossover = self.random(windows_indexes, (size, dimensions)) < DE_CROSSOVER
+        # every trial takes at least one component from its mutant
+        forced = np.stack([self.rngs[b].integers(dimensions, size=size) for b in windows_indexes])
+        crossover |= forced[..., None] == np.arange(dimensions)
+        return np.where(crossover, mutants, population)
+
+    def evolve(
+        self, date_ordinals: np.ndarray, log_prices: np.ndarray, seeds: List[List[np.ndarray]]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Args:
+            date_ordinals, log_prices: shape (B, N), one row per window.
+            seeds: starting points of each window, possibly empty.
+        Returns:
+            The best (tc, m, w) of each window, shape (B, 3), and its cost, shape (B,).
+        """
+        population = self.get_initial_population(seeds)
+        costs = self.score(population, date_ordinals, log_prices)
+
+        # windows that are still evolving, the converged ones are not scored anymore
+        active = np.arange(len(population))
+        for _ in range(DE_MAX_GENERATIONS):
+            trials = self.get_trials(population[active], active)
+            trial_costs = self.score(trials, date_ordinals[active], log_prices[active])
+            improved = trial_costs <= costs[active]
+            population[active] = np.where(improved[..., None], trials, population[active])
+            costs[active] = np.where(improved, trial_costs, costs[active])
+
+            # a window has converged once its population costs about the same everywhere
+            active_costs = costs[active]
+            converged = np.all(active_costs < SINGULAR_FIT_COST, axis=-1) & (
+                np.std(active_costs, axis=-1) <= DE_TOLERANCE * np.mean(active_costs, axis=-1)
+            )
+            active = active[~converged]
+            if len(active) == 0:
+                break
+
+        best = np.argmin(costs, axis=-1)
+        windows = np.arange(len(best))
+        return population[windows, best], costs[windows, best]
+
+    def fit(
+        self, date_ordinals: np.ndarray, log_prices: np.ndarray, seeds: List[np.ndarray]
+    ) -> Tuple[np.ndarray, float] | None:
+        """
+        Evolves a single window.
+        Returns:
+            The best (tc, m, w) found and its cost, None if no member could be fitted.
+        """
+        best_x, best_costs = self.evolve(date_ordinals[None], log_prices[None], [seeds])
+        if best_costs[0] >= SINGULAR_FIT_COST:
+            return None
+        return best_x[0], float(best_costs[0])
@@ -1,10 +1,13 @@
 from typing import List, Tuple
-from scipy.optimize import minimize
+from scipy.optimize import minimize, least_squares
 from scipy.signal import lombscargle
-from lppls.lppls_math import LPPLSMath
+from lppls.lppls_math import LPPLSMath, SINGULAR_FIT_COST
 import numpy as np
-import random
+import json
+import hashlib
 from lppls.filter_interface import FilterInterface
+from lppls.tc_profile import TcProfile
+from lppls.differential_evolution import DifferentialEvolution
 import lppls.data_loader as data_loader
 from statsmodels.tsa.ar_model import AutoReg
 from lppls.lppls_defaults import (
@@ -12,6 +15,16 @@ from lppls.lppls_defaults import (
     ADF_SIGNIFICANCE_LEVEL,
     MAX_SEARCHES,
     TRIES_TO_GET_MINIMUM,
+    NORMALIZED_SIMPLEX_STEP,
+    ADAPTIVE_AGREEING_MINIMA,
+    ADAPTIVE_PARAMS_TOLERANCE,
+    ADAPTIVE_SSR_TOLERANCE,
+    LATTICE_SEED_TC_GRID_SIZE,
+    LATTICE_SEED_M_GRID_SIZE,
+    LATTICE_SEED_W_GRID_SIZE,
+    LATTICE_SEEDS_PER_FIT,
+    GRADIENT_MINIMIZERS,
+    LEAST_SQUARES_MINIMIZERS,
 )
 from lppls.lppls_dataclasses import (
     ObservationSeries,
@@ -20,6 +33,10 @@ from lppls.lppls_dataclasses import (
     RejectionReason,
     BubbleType,
     BubbleFit,
+    FitStrategy,
+    FitStats,
+    RestartPolicy,
+    FitCoordinates,
 )
 from statsmodels.tsa.stattools import adfuller
 
@@ -37,7 +54,18 @@ class FilterBitcoin2019B(FilterInterface):
         self.filter_criteria = data_loader.load_config(filter_file)
 
     def fit(
-        self, observations: ObservationSeries, minimizer: str = "Nelder-Mead"
+        self,
+        observations: ObservationSeries,
+        minimizer: str = "Nelder-Mead",
+        strategy: FitStrategy = FitStrategy.RANDOM_RESTARTS,
+        seeds: List[np.ndarray] | None = None,
+        rng: np.random.Generator | None = None,
+        max_searches: int = MAX_SEARCHES,
+        tries_to_get_minimum: int = TRIES_TO_GET_MINIMUM,
+        warm_seed: np.ndarray | None = None,
+        stats: FitStats | None = None,
+        restart_policy: RestartPolicy = RestartPolicy.FIXED,
+        coordinates: FitCoordinates = FitCoordinates.RAW,
     ) -> OptimizedParams | None:
         """
         Args:
@@ -45,28 +73,63 @@ class FilterBitcoin2019B(FilterInterface):
             obs (Mx2 numpy array): the observed time-series data. Optional, if not included will use self.scaled_obs
             minimizer (str): See list of valid methods to pass to scipy.optimize.minimize:
                 https://docs.scipy.org/doc/scipy/reference/generated/scipy.optimize.minimize.html#scipy.optimize.minimize
+                The methods in GRADIENT_MINIMIZERS use the analytic gradient, and 'trf' or 'dogbox'
+                run scipy.optimize.least_squares on the residual vector with the exact Jacobian.
+            strategy (FitStrategy): How the search space is explored, see FitStrategy.
+            seeds (list): (tc, m, w) starting points tried before the random ones. They count
+                towards max_searches and are clipped to the search bounds. Unused by TC_PROFILE.
+            rng (np.random.Generator): Source of the random seeds. Defaults to get_window_rng, so
+                refitting the same window always gives the same result.
+            tries_to_get_minimum (int): Stop after this many successful searches.
+            warm_seed (np.ndarray): A seed from a neighbouring window's optimum, tried before seeds.
+                The fit stops early once a random search confirms its minimum, see do_minima_agree.
+            stats (FitStats): Counters updated with the work done by this fit.
+            restart_policy (RestartPolicy): FIXED stops after tries_to_get_minimum successful
+                searches, ADAPTIVE once the best minima agree (see ADAPTIVE_PARAMS_TOLERANCE).
+            coordinates (FitCoordinates): The coordinates the minimizer works in.
         Returns:
             A tuple with a boolean indicating success, and a dictionary with the values of tc, m, w, a, b, c, c1, c2, O, D
         """
 
-        t1 = observations[0].date_ordinal
-        t2 = observations[-1].date_ordinal
-        tc_bounds = (t2 + 1, t2 + (t2 - t1) * self.filter_criteria.get("tc_extra_space"))
-        m_bounds = (self.filter_criteria.get("m_min"), self.filter_criteria.get("m_max"))
-        w_bounds = (self.filter_criteria.get("w_min"), self.filter_criteria.get("w_max"))
-        search_bounds = [tc_bounds, m_bounds, w_bounds]
+        search_bounds = self.get_search_bounds(observations)
+        tc_bounds, m_bounds, w_bounds = search_bounds
 
-        tries = 0
-        min_fit, min_error = None, np.inf
-        # find bubble
-        for _ in range(0, MAX_SEARCHES):
-            tc = random.uniform(*tc_bounds)
-            m = random.uniform(*m_bounds)
-            w = random.uniform(*w_bounds)
+        if strategy == FitStrategy.TC_PROFILE:
+            return self.fit_tc_profile(observations, minimizer, search_bounds, stats, coordinates)
+
+        seeds = ([warm_seed] if warm_seed is not None else []) + (seeds or [])
+        rng = rng or self.get_window_rng(observations)
 
-            seed = np.array([tc, m, w])
+        if strategy == FitStrategy.DIFFERENTIAL_EVOLUTION:
+            return self.fit_differential_evolution(
+                observations, minimizer, search_bounds, seeds, rng, stats, coordinates
+            )
 
-            fit = self.estimate_params(observations, seed, minimizer, search_bounds)
+        if strategy == FitStrategy.LATTICE_SEEDS:
+            lattice_seeds = self.get_lattice_seeds(observations, search_bounds, stats)
+            # well placed seeds need fewer local searches, random ones only replace failed searches
+            tries_to_get_minimum = min(tries_to_get_minimum, max(len(lattice_seeds), 1))
+            seeds += lattice_seeds
+        lower_bounds, upper_bounds = zip(*search_bounds)
+
+        tries, search, stopped = 0, -1, False
+        min_fit, min_error, min_search = None, np.inf, -1
+        minima: List[Tuple[np.ndarray, float]] = []
+        warm_minimum: Tuple[np.ndarray, float] | None = None
+        # find bubble
+        for search in range(0, max_searches):
+            if search < len(seeds):
+                seed = np.clip(seeds[search], lower_bounds, upper_bounds)
+            else:
+                tc = rng.uniform(*tc_bounds)
+                m = rng.uniform(*m_bounds)
+                w = rng.uniform(*w_bounds)
+
+                seed = np.array([tc, m, w])
+
+            fit = self.estimate_params(
+                observations, seed, minimizer, search_bounds, stats, coordinates
+            )
             if not fit:
                 continue
 
@@ -75,21 +138,233 @@ class FilterBitcoin2019B(FilterInterface):
             if current_error < min_error:
                 min_fit = fit
                 min_error = current_error
-
-            if tries == TRIES_TO_GET_MINIMUM:
+                min_search = search
+
+            minimum = (np.array([fit.tc, fit.m, fit.w]), current_error)
+            if warm_seed is not None and search == 0:
+                warm_minimum = minimum
+
+            if restart_policy == RestartPolicy.ADAPTIVE:
+                minima.append(minimum)
+                if self.do_minima_agree(minima, search_bounds):
+                    stopped = True
+                    break
+            elif tries == tries_to_get_minimum:
                 assert min_fit != np.inf
-                return min_fit
+                stopped = True
+                break
+            elif warm_minimum is not None and search > 0:
+                # a random search found the warm seed's minimum again, the others would too
+                if self.do_minima_agree([warm_minimum, minimum], search_bounds):
+                    stopped = True
+                    break
+
+        if stats is not None:
+            stats.fits += 1
+            stats.failed_fits += int(min_fit is None)
+            stats.searches += search + 1
+            stats.exhausted_fits += int(not stopped)
+            if warm_seed is not None:
+                stats.warm_seed_fits += 1
+                if min_search == 0:
+                    stats.warm_seed_wins += 1
 
         return min_fit
 
+    @staticmethod
+    def do_minima_agree(
+        minima: List[Tuple[np.ndarray, float]], search_bounds: List[Tuple[float, float]]
+    ) -> bool:
+        if len(minima) < ADAPTIVE_AGREEING_MINIMA:
+            return False
+
+        best_minima = sorted(minima, key=lambda minimum: minimum[1])[:ADAPTIVE_AGREEING_MINIMA]
+        (best_x, best_error), others = best_minima[0], best_minima[1:]
+        bounds_widths = np.array([upper - lower for lower, upper in search_bounds])
+        for x, error in others:
+            if np.any(np.abs(x - best_x) > ADAPTIVE_PARAMS_TOLERANCE * bounds_widths):
+                return False
+            if error - best_error > ADAPTIVE_SSR_TOLERANCE * best_error:
+                return False
+        return True
+
+    def get_search_bounds(self, observations: ObservationSeries) -> List[Tuple[float, float]]:
+        t1 = observations[0].date_ordinal
+        t2 = observations[-1].date_ordinal
+        tc_bounds = (t2 + 1, t2 + (t2 - t1) * self.filter_criteria.get("tc_extra_space"))
+        m_bounds = (self.filter_criteria.get("m_min"), self.filter_criteria.get("m_max"))
+        w_bounds = (self.filter_criteria.get("w_min"), self.filter_criteria.get("w_max"))
+        return [tc_bounds, m_bounds, w_bounds]
+
+    def get_config_fingerprint(self) -> str:
+        config = json.dumps(self.filter_criteria, sort_keys=True)
+        return hashlib.sha256(config.encode()).hexdigest()
+
+    def fit_tc_profile(
+        self,
+        observations: ObservationSeries,
+        minimizer: str,
+        search_bounds: List[Tuple[float, float]],
+        stats: FitStats | None = None,
+        coordinates: FitCoordinates = FitCoordinates.RAW,
+    ) -> OptimizedParams | None:
+        date_ordinals = np.asarray(observations.get_date_ordinals(), dtype=float)
+        tc_profile = TcProfile(search_bounds, minimizer)
+        profile_fit = tc_profile.fit(date_ordinals, observations.get_log_prices())
+        if stats is not None:
+            stats.fits += 1
+            stats.failed_fits += int(profile_fit is None)
+            stats.searches += 1
+            stats.evaluations += tc_profile.evaluations
+        if not profile_fit:
+            return None
+
+        # The grid optimum is already a valid fit, the local refinement only moves tc off the grid.
+        seed, refine_bounds = profile_fit
+        refined_fit = self.estimate_params(
+            observations, seed, minimizer, refine_bounds, stats, coordinates
+        )
+        if refined_fit:
+            return refined_fit
+
+        tc, m, w = seed
+        a, b, c1, c2 = LPPLSMath.matrix_equation(observations, tc, m, w)
+        return OptimizedParams(tc, m, w, a, b, c1, c2)
+
+    def fit_differential_evolution(
+        self,
+        observations: ObservationSeries,
+        minimizer: str,
+        search_bounds: List[Tuple[float, float]],
+        seeds: List[np.ndarray],
+        rng: np.random.Generator,
+        stats: FitStats | None = None,
+        coordinates: FitCoordinates = FitCoordinates.RAW,
+    ) -> OptimizedParams | None:
+        date_ordinals = np.asarray(observations.get_date_ordinals(), dtype=float)
+        differential_evolution = DifferentialEvolution(search_bounds, rng)
+        evolved_fit = differential_evolution.fit(
+            date_ordinals, observations.get_log_prices(), seeds
+        )
+        if stats is not None:
+            stats.fits += 1
+            stats.failed_fits += int(evolved_fit is None)
+            stats.searches += 1
+            stats.evaluations += differential_evolution.evaluations
+        if evolved_fit is None:
+            return None
+
+        # The best member is already a valid fit, a local search polishes it off the population.
+        seed, _ = evolved_fit
+        polished_fit = self.estimate_params(
+            observations, seed, minimizer, search_bounds, stats, coordinates
+        )
+        if polished_fit:
+            return polished_fit
+
+        tc, m, w = seed
+        a, b, c1, c2 = LPPLSMath.matrix_equation(observations, tc, m, w)
+        return OptimizedParams(tc, m, w, a, b, c1, c2)
+
+    def fit_batch(
+        self,
+        observations_batch: List[ObservationSeries],
+        minimizer: str = "Nelder-Mead",
+        tickers: List[str] | None = None,
+        polish: bool = False,
+        stats: FitStats | None = None,
+        coordinates: FitCoordinates = FitCoordinates.RAW,
+    ) -> List[OptimizedParams | None]:
+        """
+        Fits windows of equal length, typically the same window of many tickers, with a single
+        batched differential evolution.
+        Args:
+            tickers (list): The ticker of each window, only used to derive the random seeds.
+            polish (bool): Refine the best member of each window with a local search, as in
+                fit_differential_evolution. This costs one minimizer call per window.
+        Returns:
+            The fit of each window, None where no member could be fitted.
+        """
+        if len({len(observations) for observations in observations_batch}) > 1:
+            raise ValueError("All the windows of a batch must have the same length")
+
+        tickers = tickers or [""] * len(observations_batch)
+        search_bounds = [
+            self.get_search_bounds(observations) for observations in observations_batch
+        ]
+        date_ordinals = np.array(
+            [observations.get_date_ordinals() for observations in observations_batch], dtype=float
+        )
+        log_prices = np.array(
+            [observations.get_log_prices() for observations in observations_batch], dtype=float
+        )
+
+        # the random stream of each window is the one fit() uses, whatever else is in the batch
+        rngs = [
+            self.get_window_rng(observations, ticker)
+            for observations, ticker in zip(observations_batch, tickers)
+        ]
+        differential_evolution = DifferentialEvolution(np.array(search_bounds), rngs)
+        best_x, best_costs = differential_evolution.evolve(
+            date_ordinals, log_prices, [[] for _ in observations_batch]
+        )
+        if stats is not None:
+            stats.fits += len(observations_batch)
+            stats.failed_fits += int(np.sum(best_costs >= SINGULAR_FIT_COST))
+            stats.searches += len(observations_batch)
+            stats.evaluations += differential_evolution.evaluations
+
+        fits: List[OptimizedParams | None] = []
+        for observations, x, cost, bounds in zip(
+            observations_batch, best_x, best_costs, search_bounds
+        ):
+            if cost >= SINGULAR_FIT_COST:
+                fits.append(None)
+                continue
+
+            polished_fit = None
+            if polish:
+                polished_fit = self.estimate_params(
+                    observations, x, minimizer, bounds, stats, coordinates
+                )
+            if polished_fit:
+                fits.append(polished_fit)
+                continue
+
+            tc, m, w = x
+            a, b, c1, c2 = LPPLSMath.matrix_equation(observations, tc, m, w)
+            fits.append(OptimizedParams(tc, m, w, a, b, c1, c2))
+
+        return fits
+
+    def get_lattice_seeds(
+        self,
+        observations: ObservationSeries,
+        search_bounds: List[Tuple[float, float]],
+        stats: FitStats | None = None,
+    ) -> List[np.ndarray]:
+        """
+        The LATTICE_SEEDS_PER_FIT best cells of a coarse (tc, m, w) lattice, scored in one batch.
+        """
+        lattice = self.get_search_lattice(
+            search_bounds,
+            (LATTICE_SEED_TC_GRID_SIZE, LATTICE_SEED_M_GRID_SIZE, LATTICE_SEED_W_GRID_SIZE),
+        )
+        costs = LPPLSMath.batch_squared_residuals(
+            lattice,
+            np.asarray(observations.get_date_ordinals(), dtype=float),
+            observations.get_log_prices(),
+        )
+        if stats is not None:
+            stats.evaluations += costs.size
+        best = np.argsort(costs)[:LATTICE_SEEDS_PER_FIT]
+        return [lattice[k] for k in best if costs[k] < SINGULAR_FIT_COST]
+
     def compute_price_error(
         self, observations: ObservationSeries, optimized_params: OptimizedParams
     ) -> float:
-        predicted_prices = LPPLSMath.get_log_price_predictions(observations, optimized_params)
-        actual_prices = observations.get_log_prices()
-        return sum(
-            [(actual_prices[i] - predicted_prices[i]) ** 2 for i in range(len(actual_prices))]
-        )
+        residuals = LPPLSMath.get_residuals(observations, optimized_params)
+        return float(np.sum(np.power(residuals, 2)))
 
     def estimate_params(
         self,
@@ -97,17 +372,56 @@ class FilterBitcoin2019B(FilterInterface):
         seed: np.ndarray,
         minimizer: str,
         search_bounds: List[Tuple[float, float]],
+        stats: FitStats | None = None,
+        coordinates: FitCoordinates = FitCoordinates.RAW,
     ) -> OptimizedParams | None:
-        cofs = minimize(
-            args=observations,
-            fun=LPPLSMath.minimize_squared_residuals,
-            x0=seed,
-            method=minimizer,
-            bounds=search_bounds,
-        )
+        if coordinates == FitCoordinates.NORMALIZED:
+            return self.estimate_normalized_params(
+                observations, seed, minimizer, search_bounds, stats
+            )
+
+        date_ordinals = np.asarray(observations.get_date_ordinals(), dtype=float)
+        args = (date_ordinals, observations.get_log_prices())
+
+        if minimizer in LEAST_SQUARES_MINIMIZERS:
+            lower_bounds, upper_bounds = zip(*search_bounds)
+            cofs = least_squares(
+                LPPLSMath.profiled_residuals,
+                x0=seed,
+                jac=LPPLSMath.profiled_jacobian,
+                bounds=(lower_bounds, upper_bounds),
+                method=minimizer,
+                args=args,
+            )
+        elif minimizer in GRADIENT_MINIMIZERS:
+            cofs = minimize(
+                args=args,
+                fun=LPPLSMath.profiled_cost_and_gradient,
+                jac=True,
+                x0=seed,
+                method=minimizer,
+                bounds=search_bounds,
+            )
+        else:
+            cofs = minimize(
+                args=args,
+                fun=LPPLSMath.fused_squared_residuals,
+                x0=seed,
+                method=minimizer,
+                bounds=search_bounds,
+            )
         # print(f'obtained cofs: {cofs}')
+        # A minimizer can also 'converge' on the flat sentinel cost of a singular fit.
+        success = (
+            cofs.success and LPPLSMath.fused_squared_residuals(cofs.x, *args) < SINGULAR_FIT_COST
+        )
+        if stats is not None:
+            stats.evaluations += cofs.nfev
+            # least_squares does not report iterations
+            stats.iterations += getattr(cofs, "nit", 0)
+            stats.failed_searches += int(not success)
 
-        if cofs.success:
+        if success:
             tc, m, w = cofs.x
             a, b, c1, c2 = LPPLSMath.matrix_equation(observations, tc, m, w)
 
@@ -115,6 +429,78 @@ class FilterBitcoin2019B(FilterInterface):
         else:
             return None
 
+    def estimate_normalized_params(
+        self,
+        observations: ObservationSeries,
+        seed: np.ndarray,
+        minimizer: str,
+        search_bounds: List[Tuple[float, float]],
+        stats: FitStats | None = None,
+    ) -> OptimizedParams | None:
+        """
+        estimate_params in FitCoordinates.NORMALIZED: time runs from -1 at t1 to 0 at t2, and the
+        minimizer moves the unbounded logits of (tc, m, w) within their bounds. The profiled cost
+        is unchanged, the linear params absorb the change of time scale.
+        """
+        date_ordinals = np.asarray(observations.get_date_ordinals(), dtype=float)
+        t2 = date_ordinals[-1]
+        time_scale = t2 - date_ordinals[0]
+        args = ((date_ordinals - t2) / time_scale, observations.get_log_prices())
+
+        (tc_lower, tc_upper), m_bounds, w_bounds = search_bounds
+        tc_bounds = ((tc_lower - t2) / time_scale, (tc_upper - t2) / time_scale)
+        bounds = np.array([tc_bounds, m_bounds, w_bounds], dtype=float)
+        z0 = LPPLSMath.to_unbounded(
+            np.array([(seed[0] - t2) / time_scale, seed[1], seed[2]]), bounds
+        )
+
+        if minimizer in LEAST_SQUARES_MINIMIZERS:
+            cofs = least_squares(
+                LPPLSMath.unbounded_residuals,
+                x0=z0,
+                jac=LPPLSMath.unbounded_jacobian,
+                method=minimizer,
+                args=(bounds, *args),
+            )
+        elif minimizer in GRADIENT_MINIMIZERS:
+            cofs = minimize(
+                args=(bounds, *args),
+                fun=LPPLSMath.unbounded_cost_and_gradient,
+                jac=True,
+                x0=z0,
+                method=minimizer,
+            )
+        else:
+            options = {}
+            if minimizer == "Nelder-Mead":
+                simplex_steps = NORMALIZED_SIMPLEX_STEP * np.eye(len(z0))
+                options["initial_simplex"] = np.vstack([z0, z0 + simplex_steps])
+            cofs = minimize(
+                args=(bounds, *args),
+                fun=LPPLSMath.unbounded_squared_residuals,
+                x0=z0,
+                method=minimizer,
+                options=options,
+            )
+        normalized_x, _ = LPPLSMath.from_unbounded(cofs.x, bounds)
+        success = (
+            cofs.success
+            and LPPLSMath.fused_squared_residuals(normalized_x, *args) < SINGULAR_FIT_COST
+        )
+        if stats is not None:
+            stats.evaluations += cofs.nfev
+            stats.iterations += getattr(cofs, "nit", 0)
+            stats.failed_searches += int(not success)
+
+        if success:
+            normalized_tc, m, w = normalized_x
+            tc = t2 + normalized_tc * time_scale
+            a, b, c1, c2 = LPPLSMath.matrix_equation(observations, tc, m, w)
+
+            return OptimizedParams(tc, m, w, a, b, c1, c2)
+        else:
+            return None
+
     def check_bubble_fit(
         self,
         oi: OptimizedInterval,
@@ -181,12 +567,7 @@ class FilterBitcoin2019B(FilterInterface):
         self, observations: ObservationSeries, optimized_params: OptimizedParams
     ) -> bool:
         # Compute the residuals between predicted and actual log prices
-        residuals = []
-        for observation in observations:
-            date_ordinal, log_price = observation.date_ordinal, np.log(observation.price)
-            predicted_log_price = LPPLSMath.predict_log_price(date_ordinal, optimized_params)
-            # not taking the log of the price because the price is already in log
-            residuals.append(predicted_log_price - log_price)
+        residuals = LPPLSMath.get_residuals(observations, optimized_params)
 
         # OptimizedParams an AR(1) model to the residuals
         ar1_model = AutoReg(residuals, lags=1).fit()
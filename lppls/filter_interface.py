@@ -1,14 +1,72 @@
 from abc import abstractmethod
+from typing import List, Tuple
+import hashlib
 import numpy as np
 from lppls.lppls_math import LPPLSMath
-from lppls.lppls_dataclasses import ObservationSeries, OptimizedParams, OptimizedInterval, BubbleFit
+from lppls.tc_profile import TcProfile
+from lppls.lppls_defaults import MAX_SEARCHES, TRIES_TO_GET_MINIMUM
+from lppls.lppls_dataclasses import (
+    ObservationSeries,
+    OptimizedParams,
+    OptimizedInterval,
+    BubbleFit,
+    FitStrategy,
+    FitStats,
+    RestartPolicy,
+    FitCoordinates,
+)
 from common.typechecking import TypeCheckBase
 from common.date_utils import DateUtils as du
 
 
 class FilterInterface(TypeCheckBase):
     @abstractmethod
-    def fit(self, observations: ObservationSeries, minimizer: str) -> OptimizedParams | None:
+    def fit(
+        self,
+        observations: ObservationSeries,
+        minimizer: str,
+        strategy: FitStrategy = FitStrategy.RANDOM_RESTARTS,
+        seeds: List[np.ndarray] | None = None,
+        rng: np.random.Generator | None = None,
+        max_searches: int = MAX_SEARCHES,
+        tries_to_get_minimum: int = TRIES_TO_GET_MINIMUM,
+        warm_seed: np.ndarray | None = None,
+        stats: FitStats | None = None,
+        restart_policy: RestartPolicy = RestartPolicy.FIXED,
+        coordinates: FitCoordinates = FitCoordinates.RAW,
+    ) -> OptimizedParams | None:
+        pass
+
+    @abstractmethod
+    def get_search_bounds(self, observations: ObservationSeries) -> List[Tuple[float, float]]:
+        pass
+
+    @abstractmethod
+    def get_config_fingerprint(self) -> str:
+        pass
+
+    def get_window_rng(
+        self, observations: ObservationSeries, ticker: str = ""
+    ) -> np.random.Generator:
+        """
+        A random stream that only depends on the ticker, the window and the filter configuration,
+        so a fit gives the same result in every run and in every worker process.
+        """
+        t1, t2 = observations[0].date_ordinal, observations[-1].date_ordinal
+        key = f"{ticker}|{t1}|{t2}|{self.get_config_fingerprint()}"
+        digest = hashlib.sha256(key.encode()).digest()
+        return np.random.default_rng(int.from_bytes(digest[:8], "little"))
+
+    @abstractmethod
+    def fit_batch(
+        self,
+        observations_batch: List[ObservationSeries],
+        minimizer: str = "Nelder-Mead",
+        tickers: List[str] | None = None,
+        polish: bool = False,
+        stats: FitStats | None = None,
+        coordinates: FitCoordinates = FitCoordinates.RAW,
+    ) -> List[OptimizedParams | None]:
         pass
 
     @abstractmethod
@@ -26,25 +84,33 @@ class FilterInterface(TypeCheckBase):
         relative_error_max: float,
         optimized_params: OptimizedParams,
     ) -> bool:
-        for observation in observations:
-            actual_price, date_ordinal = observation.price, observation.date_ordinal
-            predicted_price = np.exp(LPPLSMath.predict_log_price(date_ordinal, optimized_params))
+        actual_prices = np.asarray(observations.get_prices())
+        predicted_prices = np.exp(
+            LPPLSMath.get_log_price_predictions(observations, optimized_params)
+        )
 
-            # Update: I changed this to use price instead of log - the fits are much tighter
-            #
-            # In some papers such as the one underneath they are using the price, not its log.
-            # However, in practice that will exclude all large enough windows because there is bound to be a
-            # price difference larger than the prediction error, especially since we are not optimising for that
-            # in the minimizer
-            #
-            # Real-time Prediction of Bitcoin Bubble Crashes
-            # Authors: Min Shu, Wei Zhu
-            prediction_error = abs(actual_price - predicted_price) / actual_price
+        # Update: I changed this to use price instead of log - the fits are much tighter
+        #
+        # In some papers such as the one underneath they are using the price, not its log.
+        # However, in practice that will exclude all large enough windows because there is bound to be a
+        # price difference larger than the prediction error, especially since we are not optimising for that
+        # in the minimizer
+        #
+        # Real-time Prediction of Bitcoin Bubble Crashes
+        # Authors: Min Shu, Wei Zhu
+        prediction_errors = np.abs(actual_prices - predicted_prices) / actual_prices
 
-            if prediction_error > relative_error_max:
-                return False
+        return not bool(np.any(prediction_errors > relative_error_max))
 
-        return True
+    @staticmethod
+    def get_search_lattice(
+        search_bounds: List[Tuple[float, float]], sizes: Tuple[int, int, int]
+    ) -> np.ndarray:
+        """
+        Centres of a regular (tc, m, w) lattice within the search bounds, shape (K, 3).
+        """
+        axes = [TcProfile.cell_centres(bounds, size) for bounds, size in zip(search_bounds, sizes)]
+        return np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
 
     @staticmethod
     def get_damping(m: float, w: float, b: float, c: float) -> float:
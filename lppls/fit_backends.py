@@ -0,0 +1,40 @@
+from typing import Dict
+from lppls.lppls_dataclasses import FitBackend, FitCoordinates, FitStrategy
+
+# Every way of fitting a window that DataFit knows about, by name.
+# Compare them with lppls/demo/benchmark_fit_backends.py before changing the default.
+FIT_BACKENDS: Dict[str, FitBackend] = {
+    "nelder-mead": FitBackend("Nelder-Mead"),
+    "powell": FitBackend("Powell"),
+    # analytic gradient of the profiled cost
+    "l-bfgs-b": FitBackend("L-BFGS-B"),
+    "tnc": FitBackend("TNC"),
+    "slsqp": FitBackend("SLSQP"),
+    # bounded least squares on the residual vector, with the exact Jacobian
+    "trf": FitBackend("trf"),
+    "dogbox": FitBackend("dogbox"),
+    # batched in-house searches
+    "tc-profile": FitBackend("Nelder-Mead", FitStrategy.TC_PROFILE),
+    "lattice-nelder-mead": FitBackend("Nelder-Mead", FitStrategy.LATTICE_SEEDS),
+    "lattice-trf": FitBackend("trf", FitStrategy.LATTICE_SEEDS),
+    "differential-evolution": FitBackend("Nelder-Mead", FitStrategy.DIFFERENTIAL_EVOLUTION),
+    "differential-evolution-trf": FitBackend("trf", FitStrategy.DIFFERENTIAL_EVOLUTION),
+    # unbounded logits of (tc, m, w) on normalized time
+    "normalized-nelder-mead": FitBackend("Nelder-Mead", coordinates=FitCoordinates.NORMALIZED),
+    "normalized-l-bfgs-b": FitBackend("L-BFGS-B", coordinates=FitCoordinates.NORMALIZED),
+    "normalized-trf": FitBackend("trf", coordinates=FitCoordinates.NORMALIZED),
+}
+
+DEFAULT_FIT_BACKEND = "nelder-mead"
+
+
+def register_fit_backend(name: str, backend: FitBackend) -> None:
+    if name in FIT_BACKENDS:
+        raise ValueError(f"Fit backend {name} is already registered")
+    FIT_BACKENDS[name] = backend
+
+
+def get_fit_backend(name: str) -> FitBackend:
+    if name not in FIT_BACKENDS:
+        raise ValueError(f"Unknown fit backend {name}, expected one of {list(FIT_BACKENDS)}")
+    return FIT_BACKENDS[name]
@@ -0,0 +1,127 @@
+from typing import Dict, List, Tuple
+import hashlib
+import os
+import sqlite3
+import time
+import numpy as np
+from lppls.lppls_dataclasses import ObservationSeries, OptimizedParams
+from lppls.lppls_defaults import FIT_CACHE_FILE, FIT_CACHE_MAX_AGE_DAYS, FIT_CACHE_MAX_ENTRIES
+from common.typechecking import TypeCheckBase
+
+PARAM_COLUMNS = ["tc", "m", "w", "a", "b", "c1", "c2"]
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+# Fits of nested windows, kept on disk between runs. Consecutive days of a backtest refit almost
+# the same (t1, t2) windows, and since the random seeds of a window are derived from the window
+# itself (see FilterInterface.get_window_rng), a cached fit is the fit that would be recomputed.
+#
+# A failed fit is cached too, as None, so that it is not retried either.
+class FitCache(TypeCheckBase):
+    def __init__(
+        self,
+        path: str = FIT_CACHE_FILE,
+        max_age_days: float = FIT_CACHE_MAX_AGE_DAYS,
+        max_entries: int = FIT_CACHE_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.max_age_days = max_age_days
+        self.max_entries = max_entries
+        self.connection: sqlite3.Connection | None = None
+        self.evict()
+
+    def __getstate__(self):
+        # each Pool worker opens its own connection
+        state = self.__dict__.copy()
+        state["connection"] = None
+        return state
+
+    def connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(self.path, timeout=60)
+            # the workers read while one of them writes
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS fits (key TEXT PRIMARY KEY, created REAL, searches INTEGER, "
+                + ", ".join(f"{column} REAL" for column in PARAM_COLUMNS)
+                + ")"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS fits_created ON fits (created)")
+        return self.connection
+
+    @staticmethod
+    def get_key(
+        ticker: str, observations: ObservationSeries, config_fingerprint: str, seed_policy: str
+    ) -> str:
+        """
+        Args:
+            observations: The window that is fitted, its first and last date are t1 and t2.
+            config_fingerprint: Identifies the filter bounds, see FilterInterface.get_config_fingerprint.
+            seed_policy: Everything else the fit depends on: strategy, minimizer, seeding...
+        """
+        prices = np.asarray(observations.get_prices(), dtype=float)
+        dates = np.asarray(observations.get_date_ordinals(), dtype=np.int64)
+        price_fingerprint = hashlib.sha256(prices.tobytes() + dates.tobytes()).hexdigest()
+        t1, t2 = observations[0].date_ordinal, observations[-1].date_ordinal
+        key = f"{ticker}|{t1}|{t2}|{price_fingerprint}|{config_fingerprint}|{seed_policy}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Tuple[OptimizedParams | None, int]]:
+        """
+        Returns:
+            The cached fit and its number of searches for each of the keys that are in the cache.
+        """
+        if not keys:
+            return {}
+
+        min_created = time.time() - self.max_age_days * SECONDS_PER_DAY
+        placeholders = ", ".join("?" for _ in keys)
+        rows = (
+            self.connect()
+            .execute(
+                f"SELECT key, searches, {', '.join(PARAM_COLUMNS)} FROM fits "
+                f"WHERE key IN ({placeholders}) AND created >= ?",
+                (*keys, min_created),
+            )
+            .fetchall()
+        )
+
+        cached = {}
+        for key, searches, *params in rows:
+            optimized_params = None if params[0] is None else OptimizedParams(*params)
+            cached[key] = (optimized_params, searches)
+        return cached
+
+    def put_many(self, fits: Dict[str, Tuple[OptimizedParams | None, int]]) -> None:
+        if not fits:
+            return
+
+        created = time.time()
+        rows = []
+        for key, (optimized_params, searches) in fits.items():
+            params: List[float | None]
+            if optimized_params is None:
+                params = [None] * len(PARAM_COLUMNS)
+            else:
+                params = [float(getattr(optimized_params, column)) for column in PARAM_COLUMNS]
+            rows.append((key, created, searches, *params))
+
+        placeholders = ", ".join("?" for _ in range(len(PARAM_COLUMNS) + 3))
+        with self.connect() as connection:
+            connection.executemany(f"INSERT OR REPLACE INTO fits VALUES ({placeholders})", rows)
+
+    def evict(self) -> None:
+        """
+        Drops the fits older than max_age_days, then the oldest ones above max_entries.
+        """
+        min_created = time.time() - self.max_age_days * SECONDS_PER_DAY
+        with self.connect() as connection:
+            connection.execute("DELETE FROM fits WHERE created < ?", (min_created,))
+            connection.execute(
+                "DELETE FROM fits WHERE key IN "
+                "(SELECT key FROM fits ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
@@ -1,5 +1,5 @@
 from enum import Enum
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields
 from typing import List
 import numpy as np
 from common.date_utils import DateUtils as du
@@ -23,6 +23,48 @@ class RejectionReason(Enum):
     ANY_REASON = "any_reason"
 
 
+class FitStrategy(Enum):
+    # Nelder-Mead (or another local minimizer) from random seeds in the search bounds
+    RANDOM_RESTARTS = "random_restarts"
+    # Scan a grid of tc and only optimise (m, w) at each, then refine the best tc locally
+    TC_PROFILE = "tc_profile"
+    # Score a coarse (tc, m, w) lattice in one batch and start the local searches from its best cells
+    LATTICE_SEEDS = "lattice_seeds"
+    # Differential evolution on whole populations scored in one batch, then refined locally
+    DIFFERENTIAL_EVOLUTION = "differential_evolution"
+
+
+class FitCoordinates(Enum):
+    # tc, m, w as they are, on date ordinals, within bounds
+    RAW = "raw"
+    # time scaled to [-1, 0] over the window and each of tc, m, w logit-scaled within its bounds,
+    # so that all three are unbounded and of the same order of magnitude
+    NORMALIZED = "normalized"
+
+
+class ParallelBackend(Enum):
+    # one task per t2 window, on a multiprocessing.Pool
+    PROCESSES = "processes"
+    # all nested windows in one process, on numba threads, see ThreadedFits
+    THREADS = "threads"
+
+
+class RestartPolicy(Enum):
+    # Stop after a fixed number of successful searches
+    FIXED = "fixed"
+    # Stop as soon as the best minima agree, search longer where they don't
+    ADAPTIVE = "adaptive"
+
+
+class T1Stepping(Enum):
+    # Every t1_increment observations
+    FIXED = "fixed"
+    # Coarse t1 steps first, refined only where neighbouring fits disagree
+    ADAPTIVE = "adaptive"
+    # A random sample of the t1s, grown until the confidence is known precisely enough
+    SAMPLED = "sampled"
+
+
 @dataclass
 class BubbleFit:
     rejection_reasons: List[RejectionReason]
@@ -129,6 +171,88 @@ class OptimizedInterval:
     optimized_params: OptimizedParams
     # Make this an empty list by default
     bubble_fit: BubbleFit = None
+    # local searches the fit of this window needed
+    searches: int = 0
+    # nested windows this fit stands for in the bubble scores and pop dates, more than 1 with
+    # T1Stepping.ADAPTIVE
+    weight: int = 1
+
+
+@dataclass
+class FitStats:
+    fits: int = 0
+    # fits that did not find any minimum
+    failed_fits: int = 0
+    # local searches (restarts), seeded ones included
+    searches: int = 0
+    # cost function evaluations, a batched lattice counts one per candidate
+    evaluations: int = 0
+    # iterations of the local minimizers that report them
+    iterations: int = 0
+    # local searches that did not converge, or converged on a singular fit
+    failed_searches: int = 0
+    # fits that used all max_searches without finding their tries_to_get_minimum minima
+    exhausted_fits: int = 0
+    # time spent in the fits, summed over the worker processes
+    fit_seconds: float = 0.0
+    # nested windows whose fit was read from the FitCache
+    cache_hits: int = 0
+    # fits that were given a warm seed, and how often the kept minimum came from it
+    warm_seed_fits: int = 0
+    warm_seed_wins: int = 0
+
+    def merge(self, other: "FitStats") -> None:
+        for f in fields(self):
+            setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+
+    def summary(self) -> str:
+        searches_per_fit = self.searches / self.fits if self.fits else 0.0
+        return (
+            f"{self.fits} fits, {searches_per_fit:.1f} searches per fit, the warm seed won "
+            f"{self.warm_seed_wins} of {self.warm_seed_fits} warm started fits, "
+            f"{self.cache_hits} fits were read from the fit cache, {self.failed_searches} "
+            f"searches failed, {self.exhausted_fits} fits used all their searches, "
+            f"{self.fit_seconds:.1f}s fitting."
+        )
+
+
+@dataclass
+class FitBackend:
+    # passed to scipy.optimize.minimize, or least_squares for 'trf' and 'dogbox'
+    minimizer: str
+    strategy: FitStrategy = FitStrategy.RANDOM_RESTARTS
+    coordinates: FitCoordinates = FitCoordinates.RAW
+
+
+@dataclass
+class FitBudget:
+    # searches and successful searches of every nested fit, see FilterBitcoin2019B.fit
+    max_searches: int
+    tries_to_get_minimum: int
+    # observations between the t1s of the nested windows, and between the t2 windows
+    t1_increment: int
+    t2_increment: int
+
+
+@dataclass
+class WindowScale:
+    """
+    The nested windows of one t2: from largest_window_size observations down to
+    smallest_window_size, every t1_increment observations.
+    """
+
+    name: str
+    largest_window_size: int
+    smallest_window_size: int
+    t1_increment: int
+
+    def get_window_sizes(self) -> List[int]:
+        return [
+            self.largest_window_size - j
+            for j in range(
+                0, self.largest_window_size - self.smallest_window_size, self.t1_increment
+            )
+        ]
 
 
 @dataclass
@@ -137,6 +261,10 @@ class IntervalFits:
     t1: int
     t2: int
     p2: float
+    fit_stats: FitStats = field(default_factory=FitStats)
+    # with T1Stepping.SAMPLED, the nested windows that were fitted out of all of them
+    sampled_windows: int = 0
+    nested_windows: int = 0
 
 
 @dataclass
@@ -146,3 +274,7 @@ class BubbleScore:
     pos_conf: float
     neg_conf: float
     optimized_intervals: List[OptimizedInterval]
+    # half-width of the confidence intervals of pos_conf and neg_conf when they are estimated from a
+    # sample of the nested windows, 0 when they are exact
+    pos_conf_error: float = 0.0
+    neg_conf_error: float = 0.0
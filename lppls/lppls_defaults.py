@@ -9,10 +9,100 @@ T1_STEP = 2
 # t2 of 5 is used in the Bitcoin paper
 T2_STEP = 1
 
+# The budgets of the fits (MAX_SEARCHES, TRIES_TO_GET_MINIMUM, T1_STEP and T2_STEP) can be compared
+# with python -m lppls.demo.tune_fit_budget
 MAX_SEARCHES = 25
 # 7 is an optimal number to get rid of spikes (can see from Lagrange coefficient computation from branch fixStartingPoint)
 TRIES_TO_GET_MINIMUM = 3
 
+# scipy.optimize.minimize methods which are given the analytic gradient of the profiled cost
+GRADIENT_MINIMIZERS = ["L-BFGS-B", "TNC", "SLSQP"]
+# scipy.optimize.least_squares methods, run on the profiled residual vector
+LEAST_SQUARES_MINIMIZERS = ["trf", "dogbox"]
+
+# Adaptive restarts stop once the best ADAPTIVE_AGREEING_MINIMA minima agree: (tc, m, w) within this
+# fraction of the width of their search bounds, and SSR within this relative difference.
+ADAPTIVE_AGREEING_MINIMA = 2
+ADAPTIVE_PARAMS_TOLERANCE = 0.01
+ADAPTIVE_SSR_TOLERANCE = 0.001
+
+# tc-profiled calibration, as in 'A Stable and Robust Calibration Scheme of the Log-Periodic Power Law Model'.
+# The (m, w) lattice is evaluated for every tc in one batch, then (m, w) is optimised at the best few tcs.
+TC_PROFILE_GRID_SIZE = 16
+TC_PROFILE_M_GRID_SIZE = 5
+TC_PROFILE_W_GRID_SIZE = 6
+TC_PROFILE_REFINED_TCS = 3
+
+# Coarse lattice of FitStrategy.LATTICE_SEEDS, scored in one batch before any local search.
+LATTICE_SEED_TC_GRID_SIZE = 8
+LATTICE_SEED_M_GRID_SIZE = 4
+LATTICE_SEED_W_GRID_SIZE = 6
+LATTICE_SEEDS_PER_FIT = 2
+
+# Lattice scored on all nested t1 windows of a t2 at once, from one cumulative sum.
+# Each window then starts its local searches from its best lattice cells instead of random seeds.
+NESTED_SEED_TC_GRID_SIZE = 8
+NESTED_SEED_M_GRID_SIZE = 4
+NESTED_SEED_W_GRID_SIZE = 6
+NESTED_SEEDS_PER_WINDOW = TRIES_TO_GET_MINIMUM
+
+# A fit warm started from the previous t2 window is only kept if its SSR is at most this many times
+# the SSR of the fit it started from. Otherwise the window is refitted from random seeds.
+WARM_START_MAX_SSR_RATIO = 1.25
+
+# Side of the initial Nelder-Mead simplex in FitCoordinates.NORMALIZED, in logit units. scipy's
+# default of 5% of each coordinate collapses on logits near 0, the middle of the bounds.
+NORMALIZED_SIMPLEX_STEP = 0.5
+
+# Differential evolution of FitStrategy.DIFFERENTIAL_EVOLUTION, stopped once the standard deviation
+# of the population costs is below DE_TOLERANCE times their mean.
+DE_POPULATION_SIZE = 30
+DE_MAX_GENERATIONS = 60
+DE_MUTATION = 0.7
+DE_CROSSOVER = 0.9
+DE_TOLERANCE = 0.01
+
+# Nelder-Mead of ThreadedFits, with scipy's default options for 3 parameters. The maximum number of
+# iterations is also the maximum number of cost evaluations.
+THREADED_NELDER_MEAD_MAX_ITERATIONS = 600
+THREADED_NELDER_MEAD_XATOL = 1e-4
+THREADED_NELDER_MEAD_FATOL = 1e-4
+
+# T1Stepping.ADAPTIVE first fits every ADAPTIVE_T1_COARSE_STEPS-th t1, then refines between two
+# neighbouring fits that differ in bubble type or qualification, or whose tcs are further apart than
+# ADAPTIVE_T1_TC_TOLERANCE days.
+ADAPTIVE_T1_COARSE_STEPS = 4
+ADAPTIVE_T1_TC_TOLERANCE = 10
+
+# T1Stepping.SAMPLED fits random t1s SAMPLED_T1_BATCH_SIZE at a time, at least SAMPLED_T1_MIN_WINDOWS,
+# until both confidences are within SAMPLED_CONF_MAX_ERROR or clearly on one side of BUBBLE_THRESHOLD,
+# at the SAMPLED_CONF_Z normal quantile (95%).
+SAMPLED_T1_BATCH_SIZE = 8
+SAMPLED_T1_MIN_WINDOWS = 16
+SAMPLED_CONF_MAX_ERROR = 0.05
+SAMPLED_CONF_Z = 1.96
+
+# Fits of nested windows kept on disk between runs, see FitCache.
+FIT_CACHE_FILE = "./cache/lppls_fits.sqlite"
+FIT_CACHE_MAX_AGE_DAYS = 30
+FIT_CACHE_MAX_ENTRIES = 2_000_000
+
+# Residual bootstrap of the tc of the qualified fits, see PopDates.compute_tc_distribution. The
+# work is about BOOTSTRAP_MAX_WINDOWS * BOOTSTRAP_RESAMPLES differential evolution runs, batched
+# per window and spread over BOOTSTRAP_WORKERS processes.
+BOOTSTRAP_RESAMPLES = 40
+BOOTSTRAP_MAX_WINDOWS = 30
+BOOTSTRAP_WORKERS = 4
+# Residuals are resampled in blocks of consecutive days, to keep their autocorrelation.
+BOOTSTRAP_BLOCK_SIZE = 5
+TC_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+# The pop dates range of a tc distribution is the range between these quantiles.
+POP_RANGE_QUANTILES = (0.25, 0.75)
+
+
+# A Jacobi-scaled 4x4 normal matrix with a determinant below this is treated as singular:
+# the fit costs SINGULAR_FIT_COST instead of raising from inside the minimizer.
+SINGULAR_MATRIX_TOLERANCE = 1e-12
 
 # Lomb test from:
 # Real-time Prediction of Bitcoin Bubble Crashes (2019)
@@ -48,10 +138,14 @@ OPTIMIZE_DISQUALIFY_TIME = 8 * 22  # 8 months, with working days
 OPTIMIZE_T1_STEP = 4
 
 
-# These could be used for a stricter fit.However, that is not implemented at present.
+# Window scales of the multi-scale confidence, see DataFit.parallel_compute_multi_scale_fits.
+# The strict configuration is the long scale, the default one the medium scale.
 LARGEST_WINDOW_SIZE_STRICT = 180
 SMALLEST_WINDOW_SIZE_STRICT = 20
 T1_STEP_STRICT = 1
+LARGEST_WINDOW_SIZE_SHORT = 60
+SMALLEST_WINDOW_SIZE_SHORT = 20
+T1_STEP_SHORT = 2
 
 
 # Value over which an item is considered to be in a bubble
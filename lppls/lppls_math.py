@@ -1,7 +1,112 @@
 import numpy as np
 from lppls.lppls_dataclasses import ObservationSeries, OptimizedParams
-from typing import List
+from typing import List, Tuple
 from common.typechecking import TypeCheckBase
+from lppls.lppls_defaults import SINGULAR_MATRIX_TOLERANCE
+from numba import njit
+
+# Returned instead of raising when the linear params can not be solved for.
+# It is finite so that minimizers can still take differences between costs.
+SINGULAR_FIT_COST = 1e10
+# to_unbounded keeps points this far inside their bounds, as a fraction of the bounds width
+UNBOUNDED_EDGE = 1e-6
+
+
+@njit(cache=True, error_model="numpy")
+def _solve_linear_params(a, x):
+    """
+    Solves the augmented 4x5 normal-equation system `a` in place into `x`, without raising.
+    Uses the same Jacobi scaling and determinant test as LPPLSMath.solve_linear_params.
+    Returns:
+        (bool) False if the system is too ill-conditioned to solve, `x` is then undefined.
+    """
+    scale = np.empty(4)
+    for i in range(4):
+        if a[i, i] <= 0.0:
+            return False
+        scale[i] = np.sqrt(a[i, i])
+    for i in range(4):
+        for j in range(4):
+            a[i, j] /= scale[i] * scale[j]
+        a[i, 4] /= scale[i]
+
+    # Gaussian elimination with partial pivoting, the product of the pivots is the determinant.
+    determinant = 1.0
+    for col in range(4):
+        pivot = col
+        for row in range(col + 1, 4):
+            if abs(a[row, col]) > abs(a[pivot, col]):
+                pivot = row
+        if pivot != col:
+            for k in range(5):
+                a[col, k], a[pivot, k] = a[pivot, k], a[col, k]
+        determinant *= a[col, col]
+        if abs(determinant) <= SINGULAR_MATRIX_TOLERANCE:
+            return False
+        for row in range(col + 1, 4):
+            factor = a[row, col] / a[col, col]
+            for k in range(col, 5):
+                a[row, k] -= factor * a[col, k]
+
+    for row in range(3, -1, -1):
+        acc = a[row, 4]
+        for k in range(row + 1, 4):
+            acc -= a[row, k] * x[k]
+        x[row] = acc / a[row, row]
+    for i in range(4):
+        x[i] /= scale[i]
+    return True
+
+
+@njit(cache=True, error_model="numpy")
+def _fused_squared_residuals(date_ordinals, log_prices, tc, m, w):
+    """
+    Kernel behind LPPLSMath.fused_squared_residuals.
+    """
+    n = date_ordinals.shape[0]
+    if tc <= date_ordinals[n - 1]:
+        return SINGULAR_FIT_COST
+
+    # Log prices are shifted by the first one; the intercept absorbs the shift and the
+    # sums below lose much less precision when the residuals are recovered from them.
+    y0 = log_prices[0]
+    sf = sg = sh = sff = sfg = sfh = sgg = sgh = shh = 0.0
+    sy = syf = syg = syh = syy = 0.0
+    for i in range(n):
+        dT = tc - date_ordinals[i]
+        log_dT = np.log(dT)
+        fi = np.exp(m * log_dT)
+        gi = fi * np.cos(w * log_dT)
+        hi = fi * np.sin(w * log_dT)
+        yi = log_prices[i] - y0
+
+        sf += fi
+        sg += gi
+        sh += hi
+        sff += fi * fi
+        sfg += fi * gi
+        sfh += fi * hi
+        sgg += gi * gi
+        sgh += gi * hi
+        shh += hi * hi
+        sy += yi
+        syf += yi * fi
+        syg += yi * gi
+        syh += yi * hi
+        syy += yi * yi
+
+    a = np.empty((4, 5))
+    a[0, 0], a[0, 1], a[0, 2], a[0, 3], a[0, 4] = n, sf, sg, sh, sy
+    a[1, 0], a[1, 1], a[1, 2], a[1, 3], a[1, 4] = sf, sff, sfg, sfh, syf
+    a[2, 0], a[2, 1], a[2, 2], a[2, 3], a[2, 4] = sg, sfg, sgg, sgh, syg
+    a[3, 0], a[3, 1], a[3, 2], a[3, 3], a[3, 4] = sh, sfh, sgh, shh, syh
+    x = np.empty(4)
+    if not _solve_linear_params(a, x):
+        return SINGULAR_FIT_COST
+
+    # At the least-squares optimum, SSR = y'y - beta'X'y
+    ssr = syy - (x[0] * sy + x[1] * syf + x[2] * syg + x[3] * syh)
+    return max(ssr, 0.0) / n
 
 
 class LPPLSMath(TypeCheckBase):
@@ -14,13 +119,32 @@ class LPPLSMath(TypeCheckBase):
             b + ((c1 * np.cos(w * np.log(tc - t))) + (c2 * np.sin(w * np.log(tc - t))))
         )
 
+    @staticmethod
+    def predict_log_prices(date_ordinals: np.ndarray, op: OptimizedParams) -> np.ndarray:
+        """
+        Array version of predict_log_price - evaluates the whole window in one expression.
+        """
+        t = np.asarray(date_ordinals, dtype=float)
+        assert np.all(t < op.tc), "we can only predict up to time t smaller than tc"
+
+        dT = op.tc - t
+        phase = op.w * np.log(dT)
+        return op.a + np.power(dT, op.m) * (op.b + op.c1 * np.cos(phase) + op.c2 * np.sin(phase))
+
+    @staticmethod
+    def get_residuals(observations: ObservationSeries, op: OptimizedParams) -> np.ndarray:
+        """
+        Predicted minus actual log price, for every observation in the window.
+        """
+        return LPPLSMath.get_log_price_predictions(observations, op) - observations.get_log_prices()
+
     @staticmethod
     def matrix_equation(observations: ObservationSeries, tc, m, w) -> List[float]:
         """
         Derive linear parameters in LPPLs from nonlinear ones.
         """
         assert observations[-1].date_ordinal < tc  # all observations should be before tc
-        D = observations.get_date_ordinals()
+        D = np.asarray(observations.get_date_ordinals(), dtype=float)
         logP = observations.get_log_prices()
         N = len(observations)
 
@@ -53,8 +177,38 @@ class LPPLSMath(TypeCheckBase):
             ]
         )
 
-        matrix_2 = np.array([[np.sum(yi)], [np.sum(yifi)], [np.sum(yigi)], [np.sum(yihi)]])
-        return np.linalg.solve(matrix_1, matrix_2).flatten().tolist()
+        matrix_2 = np.array([np.sum(yi), np.sum(yifi), np.sum(yigi), np.sum(yihi)])
+        solution, well_conditioned = LPPLSMath.solve_linear_params(matrix_1, matrix_2)
+        if not well_conditioned:
+            # the fit is degenerate, but the minimum norm solution is still a valid set of params
+            solution = np.linalg.lstsq(matrix_1, matrix_2, rcond=None)[0]
+        return solution.tolist()
+
+    @staticmethod
+    def solve_linear_params(matrices: np.ndarray, rhs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Solves a stack of 4x4 normal equations for a, b, c1, c2 without raising.
+        Each system is Jacobi scaled first, which makes its determinant a cheap conditioning
+        measure: 1 for orthogonal columns, going to 0 as they become collinear.
+        Args:
+            matrices(np.ndarray):   shape (..., 4, 4).
+            rhs(np.ndarray):        shape (..., 4).
+        Returns:
+            The (..., 4) solutions, nan where the system is ill-conditioned, and the (...) mask
+            of well-conditioned systems.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = np.sqrt(np.diagonal(matrices, axis1=-2, axis2=-1))
+            scaled = matrices / (scale[..., :, None] * scale[..., None, :])
+            well_conditioned = np.abs(np.linalg.det(scaled)) > SINGULAR_MATRIX_TOLERANCE
+            scaled_rhs = (rhs / scale)[well_conditioned]
+
+        solutions = np.full(np.shape(rhs), np.nan)
+        solutions[well_conditioned] = (
+            np.linalg.solve(scaled[well_conditioned], scaled_rhs[..., None])[..., 0]
+            / scale[well_conditioned]
+        )
+        return solutions, well_conditioned
 
     @staticmethod
     def minimize_squared_residuals(x, observations: ObservationSeries):
@@ -68,19 +222,281 @@ class LPPLSMath(TypeCheckBase):
             (float)
         """
 
-        tc = x[0]
-        m = x[1]
-        w = x[2]
+        date_ordinals = np.asarray(observations.get_date_ordinals(), dtype=float)
+        return LPPLSMath.fused_squared_residuals(x, date_ordinals, observations.get_log_prices())
 
-        a, b, c1, c2 = LPPLSMath.matrix_equation(observations, tc, m, w)
-        op = OptimizedParams(tc, m, w, a, b, c1, c2)
+    @staticmethod
+    def fused_squared_residuals(x, date_ordinals: np.ndarray, log_prices: np.ndarray) -> float:
+        """
+        Same cost as minimize_squared_residuals, but JIT compiled: the normal-equation sums, the
+        solve for a, b, c1, c2 and the residuals are all done in one pass over the window.
+        Pass the arrays straight to the minimizer so they are not rebuilt on every call.
+        """
+        return _fused_squared_residuals(date_ordinals, log_prices, x[0], x[1], x[2])
+
+    @staticmethod
+    def fused_squared_residuals_with_fixed_tc(
+        x, tc: float, date_ordinals: np.ndarray, log_prices: np.ndarray
+    ) -> float:
+        """
+        fused_squared_residuals as a function of x = (m, w) only, for a tc profile.
+        """
+        return _fused_squared_residuals(date_ordinals, log_prices, tc, x[0], x[1])
+
+    @staticmethod
+    def profile_linear_params(x, date_ordinals: np.ndarray, log_prices: np.ndarray):
+        """
+        Profiles a, b, c1, c2 out of the cost for fixed nonlinear x = (tc, m, w).
+        The solve goes through a QR factorisation of the design matrix, which the gradient and
+        the Jacobian below reuse.
+        Returns:
+            (tuple) log(tc - t), the design matrix columns, its QR factors, the linear params, the
+            residuals (predicted minus actual log price) and whether the solve was well-conditioned.
+            When it is not, the linear params are the minimum norm least-squares solution.
+        """
+        tc, m, w = x[0], x[1], x[2]
+        log_dT = np.log(tc - date_ordinals)
+        fi = np.exp(m * log_dT)
+        gi = fi * np.cos(w * log_dT)
+        hi = fi * np.sin(w * log_dT)
+        X = np.column_stack([np.ones_like(fi), fi, gi, hi])
+
+        Q, R = np.linalg.qr(X)
+        # det(R) / prod(column norms) is the square root of the determinant of the scaled normal
+        # matrix, so this is the same test as in solve_linear_params.
+        well_conditioned = bool(
+            np.prod(np.abs(np.diag(R)) / np.linalg.norm(X, axis=0))
+            > np.sqrt(SINGULAR_MATRIX_TOLERANCE)
+        )
+        if well_conditioned:
+            linear_params = np.linalg.solve(R, Q.T @ log_prices)
+        else:
+            linear_params = np.linalg.lstsq(X, log_prices, rcond=None)[0]
+        residuals = X @ linear_params - log_prices
+        return log_dT, X, Q, R, linear_params, residuals, well_conditioned
 
-        return LPPLSMath.sum_of_squared_residuals(observations, op)
+    @staticmethod
+    def prediction_derivatives(x, log_dT: np.ndarray, X: np.ndarray, linear_params: np.ndarray):
+        """
+        Derivatives of the design matrix and of the predicted log price with respect to tc, m, w.
+        Returns:
+            (tuple) a (3, N, 4) stack of dX/dx_k and a (3, N) stack of dX/dx_k @ linear_params.
+        """
+        m, w = x[1], x[2]
+        _, fi, gi, hi = X.T
+        inv_dT = np.exp(-log_dT)
+        zeros = np.zeros_like(fi)
+
+        dX = np.stack(
+            [
+                np.column_stack(
+                    [zeros, m * fi * inv_dT, (m * gi - w * hi) * inv_dT, (m * hi + w * gi) * inv_dT]
+                ),
+                np.column_stack([zeros, fi * log_dT, gi * log_dT, hi * log_dT]),
+                np.column_stack([zeros, zeros, -hi * log_dT, gi * log_dT]),
+            ]
+        )
+        return dX, dX @ linear_params
+
+    @staticmethod
+    def profiled_cost_and_gradient(x, date_ordinals: np.ndarray, log_prices: np.ndarray):
+        """
+        The fused_squared_residuals cost together with its exact gradient in (tc, m, w).
+        The linear params are at their optimum for every x, so by variable projection the gradient
+        is that of the cost with a, b, c1, c2 held fixed. Use with jac=True in scipy.optimize.minimize.
+        """
+        log_dT, X, _, _, linear_params, residuals, well_conditioned = (
+            LPPLSMath.profile_linear_params(x, date_ordinals, log_prices)
+        )
+        if not well_conditioned:
+            return SINGULAR_FIT_COST, np.zeros(3)
+        _, d_prediction = LPPLSMath.prediction_derivatives(x, log_dT, X, linear_params)
+
+        n = len(residuals)
+        cost = np.sum(np.power(residuals, 2)) / n
+        gradient = 2 * (d_prediction @ residuals) / n
+        return cost, gradient
+
+    @staticmethod
+    def profiled_residuals(x, date_ordinals: np.ndarray, log_prices: np.ndarray) -> np.ndarray:
+        """
+        Residual vector of the profiled problem, for scipy.optimize.least_squares.
+        """
+        return LPPLSMath.profile_linear_params(x, date_ordinals, log_prices)[5]
+
+    @staticmethod
+    def profiled_jacobian(x, date_ordinals: np.ndarray, log_prices: np.ndarray) -> np.ndarray:
+        """
+        Exact (Golub-Pereyra) Jacobian of profiled_residuals, shape (N, 3).
+        With P the projection off the columns of X and r the residuals, column k is
+        P @ dX_k @ linear_params - pinv(X).T @ dX_k.T @ r.
+        On an ill-conditioned X the second term is dropped (Kaufman's approximation).
+        """
+        log_dT, X, Q, R, linear_params, residuals, well_conditioned = (
+            LPPLSMath.profile_linear_params(x, date_ordinals, log_prices)
+        )
+        dX, d_prediction = LPPLSMath.prediction_derivatives(x, log_dT, X, linear_params)
+
+        projected = d_prediction - (d_prediction @ Q) @ Q.T
+        if not well_conditioned:
+            return projected.T
+        # pinv(X).T == Q @ inv(R).T
+        dXt_r = np.einsum("kni,n->ik", dX, residuals)
+        correction = Q @ np.linalg.solve(R.T, dXt_r)
+        return (projected - correction.T).T
+
+    @staticmethod
+    def to_unbounded(x, bounds: np.ndarray) -> np.ndarray:
+        """
+        Logit of the position of each of (tc, m, w) within its bounds, an array of shape (3, 2).
+        Points on the bounds are moved just inside them, where the logit is finite.
+        """
+        lower, upper = bounds[:, 0], bounds[:, 1]
+        position = np.clip(
+            (np.asarray(x) - lower) / (upper - lower), UNBOUNDED_EDGE, 1 - UNBOUNDED_EDGE
+        )
+        return np.log(position / (1 - position))
+
+    @staticmethod
+    def from_unbounded(z, bounds: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Inverse of to_unbounded.
+        Returns:
+            (tc, m, w) and its derivative with respect to z.
+        """
+        lower, upper = bounds[:, 0], bounds[:, 1]
+        # the logistic function, written with tanh so that it can not overflow
+        position = (1 + np.tanh(np.asarray(z) / 2)) / 2
+        return lower + (upper - lower) * position, (upper - lower) * position * (1 - position)
+
+    @staticmethod
+    def unbounded_squared_residuals(
+        z, bounds: np.ndarray, date_ordinals: np.ndarray, log_prices: np.ndarray
+    ) -> float:
+        x, _ = LPPLSMath.from_unbounded(z, bounds)
+        return LPPLSMath.fused_squared_residuals(x, date_ordinals, log_prices)
+
+    @staticmethod
+    def unbounded_cost_and_gradient(
+        z, bounds: np.ndarray, date_ordinals: np.ndarray, log_prices: np.ndarray
+    ):
+        x, dx_dz = LPPLSMath.from_unbounded(z, bounds)
+        cost, gradient = LPPLSMath.profiled_cost_and_gradient(x, date_ordinals, log_prices)
+        return cost, gradient * dx_dz
+
+    @staticmethod
+    def unbounded_residuals(
+        z, bounds: np.ndarray, date_ordinals: np.ndarray, log_prices: np.ndarray
+    ) -> np.ndarray:
+        x, _ = LPPLSMath.from_unbounded(z, bounds)
+        return LPPLSMath.profiled_residuals(x, date_ordinals, log_prices)
+
+    @staticmethod
+    def unbounded_jacobian(
+        z, bounds: np.ndarray, date_ordinals: np.ndarray, log_prices: np.ndarray
+    ) -> np.ndarray:
+        x, dx_dz = LPPLSMath.from_unbounded(z, bounds)
+        return LPPLSMath.profiled_jacobian(x, date_ordinals, log_prices) * dx_dz
+
+    @staticmethod
+    def batch_squared_residuals(
+        candidates: np.ndarray, date_ordinals: np.ndarray, log_prices: np.ndarray
+    ) -> np.ndarray:
+        """
+        Vectorized fused_squared_residuals for many (tc, m, w) candidates at once.
+        Args:
+            candidates(np.ndarray):     shape (..., K, 3), one (tc, m, w) row per candidate.
+            date_ordinals(np.ndarray):  shape (..., N), broadcast against the candidate batches.
+            log_prices(np.ndarray):     same shape as date_ordinals.
+        Returns:
+            (np.ndarray) of shape (..., K), SINGULAR_FIT_COST where tc is not after the last
+            observation or the linear params can not be solved for.
+        """
+        candidates = np.asarray(candidates, dtype=float)
+        t = np.asarray(date_ordinals, dtype=float)[..., None, :]
+        y = np.asarray(log_prices, dtype=float)
+        # shifted like in the fused kernel, the intercept absorbs it
+        y = (y - y[..., :1])[..., None, :]
+        n = t.shape[-1]
+
+        valid = candidates[..., 0] > t[..., -1]
+        # invalid candidates are evaluated at a harmless tc and masked out at the end
+        tc = np.where(valid, candidates[..., 0], t[..., -1] + 1)[..., None]
+        m, w = candidates[..., 1:2], candidates[..., 2:3]
+
+        log_dT = np.log(tc - t)
+        fi = np.exp(m * log_dT)
+        X = np.stack(
+            [np.ones_like(fi), fi, fi * np.cos(w * log_dT), fi * np.sin(w * log_dT)], axis=-1
+        )
+        Xt = np.swapaxes(X, -1, -2)
+        XtX = Xt @ X
+        Xty = (Xt @ y[..., None])[..., 0]
+        beta, well_conditioned = LPPLSMath.solve_linear_params(XtX, Xty)
+
+        ssr = np.sum(np.power(y, 2), axis=-1) - np.sum(beta * Xty, axis=-1)
+        return np.where(valid & well_conditioned, np.maximum(ssr, 0.0) / n, SINGULAR_FIT_COST)
+
+    @staticmethod
+    def nested_squared_residuals(
+        candidates: np.ndarray,
+        date_ordinals: np.ndarray,
+        log_prices: np.ndarray,
+        starts: np.ndarray,
+    ) -> np.ndarray:
+        """
+        batch_squared_residuals for every nested window [start:] ending on the last observation.
+        The normal-equation sums of such a window are suffix sums of per-point terms, so one
+        cumulative sum over the largest window gives the sums of all the nested ones.
+        Args:
+            candidates(np.ndarray):     shape (K, 3), one (tc, m, w) row per candidate.
+            date_ordinals(np.ndarray):  shape (N,), the largest window.
+            log_prices(np.ndarray):     shape (N,).
+            starts(np.ndarray):         shape (J,), index of the first observation of each window.
+        Returns:
+            (np.ndarray) of shape (K, J).
+        """
+        candidates = np.asarray(candidates, dtype=float)
+        t = np.asarray(date_ordinals, dtype=float)
+        # shifted by the last log price, which every nested window shares
+        y = np.asarray(log_prices, dtype=float) - log_prices[-1]
+        starts = np.asarray(starts, dtype=int)
+        k, n = len(candidates), len(t)
+
+        valid = candidates[:, 0] > t[-1]
+        tc = np.where(valid, candidates[:, 0], t[-1] + 1)[:, None]
+        m, w = candidates[:, 1:2], candidates[:, 2:3]
+
+        log_dT = np.log(tc - t)
+        fi = np.exp(m * log_dT)
+        X = np.stack(
+            [np.ones_like(fi), fi, fi * np.cos(w * log_dT), fi * np.sin(w * log_dT)], axis=-1
+        )
+        terms = np.concatenate(
+            [
+                (X[..., :, None] * X[..., None, :]).reshape(k, n, 16),
+                X * y[:, None],
+                np.broadcast_to(np.power(y, 2)[:, None], (k, n, 1)),
+            ],
+            axis=-1,
+        )
+        suffix_sums = np.cumsum(terms[:, ::-1], axis=1)[:, ::-1][:, starts]
+
+        XtX = suffix_sums[..., :16].reshape(k, len(starts), 4, 4)
+        Xty = suffix_sums[..., 16:20]
+        beta, well_conditioned = LPPLSMath.solve_linear_params(XtX, Xty)
+
+        ssr = suffix_sums[..., 20] - np.sum(beta * Xty, axis=-1)
+        window_sizes = n - starts
+        return np.where(
+            valid[:, None] & well_conditioned,
+            np.maximum(ssr, 0.0) / window_sizes,
+            SINGULAR_FIT_COST,
+        )
 
     @staticmethod
     def sum_of_squared_residuals(observations: ObservationSeries, op: OptimizedParams) -> float:
-        log_price_predictions = LPPLSMath.get_log_price_predictions(observations, op)
-        delta = np.subtract(log_price_predictions, observations.get_log_prices())
+        delta = LPPLSMath.get_residuals(observations, op)
 
         return np.sum(np.power(delta, 2)) / len(delta)
 
@@ -95,13 +511,5 @@ class LPPLSMath(TypeCheckBase):
     @staticmethod
     def get_log_price_predictions(
         observations: ObservationSeries, op: OptimizedParams
-    ) -> List[float]:
-        log_price_prediction = []
-        date_ordinals = observations.get_date_ordinals()
-
-        for t in date_ordinals:
-            assert t < op.tc, "we can only predict up to time t smaller than tc"
-            predicted_log_price = LPPLSMath.predict_log_price(t, op)
-            log_price_prediction.append(predicted_log_price)
-
-        return log_price_prediction
+    ) -> np.ndarray:
+        return LPPLSMath.predict_log_prices(np.asarray(observations.get_date_ordinals()), op)
@@ -1,16 +1,44 @@
 import numpy as np
 from lppls.bubble_scores import BubbleScores
 from lppls.data_fit import DataFit
+from lppls.fit_cache import FitCache
 from lppls.filter_bitcoin2019B import FilterBitcoin2019B
 from lppls.filter_interface import FilterInterface
 from lppls.lppls_math import LPPLSMath
-from lppls.lppls_dataclasses import BubbleStart, ObservationSeries, BubbleType, Peak, BubbleScore
+from lppls.lppls_defaults import LARGEST_WINDOW_SIZE, SAMPLED_CONF_MAX_ERROR
+from lppls.lppls_dataclasses import (
+    BubbleStart,
+    ObservationSeries,
+    BubbleType,
+    Peak,
+    BubbleScore,
+    OptimizedInterval,
+    OptimizedParams,
+    FitStrategy,
+    RestartPolicy,
+    FitCoordinates,
+    T1Stepping,
+)
 from common.typechecking import TypeCheckBase
-from typing import List
+from typing import Dict, List, Tuple
 
 
 class Sornette(TypeCheckBase):
-    def __init__(self, observations: ObservationSeries, filter_type, filter_file, should_optimize):
+    def __init__(
+        self,
+        observations: ObservationSeries,
+        filter_type,
+        filter_file,
+        should_optimize,
+        fit_strategy: FitStrategy = FitStrategy.RANDOM_RESTARTS,
+        ticker: str = "",
+        restart_policy: RestartPolicy = RestartPolicy.FIXED,
+        minimizer: str = "Nelder-Mead",
+        fit_cache: FitCache | None = None,
+        coordinates: FitCoordinates = FitCoordinates.RAW,
+        t1_stepping: T1Stepping = T1Stepping.FIXED,
+        conf_max_error: float = SAMPLED_CONF_MAX_ERROR,
+    ):
         filter: FilterInterface
 
         if filter_type == "BitcoinB":
@@ -18,24 +46,78 @@ class Sornette(TypeCheckBase):
         else:
             raise Exception("Filter type not supported")
 
-        self.data_fit = DataFit(observations, filter)
+        self.data_fit = DataFit(
+            observations,
+            filter,
+            fit_strategy,
+            ticker,
+            restart_policy,
+            minimizer,
+            fit_cache,
+            coordinates,
+            t1_stepping,
+            conf_max_error,
+        )
         self.bubble_scores = BubbleScores(observations, filter)
         self.should_optimize = should_optimize
 
-    def estimate_prices(self):
-        op = self.data_fit.fit(self.data_fit.observations)
-        assert op is not None
-        return list(np.exp(LPPLSMath.get_log_price_predictions(self.data_fit.observations, op)))
+    def get_recent_fit(
+        self,
+        window_size: int | None = LARGEST_WINDOW_SIZE,
+        optimized_interval: OptimizedInterval | None = None,
+    ) -> Tuple[ObservationSeries, OptimizedParams]:
+        """
+        Args:
+            window_size: Only the last window_size observations are fitted, all of them if None.
+                The nested windows of the bubble scores are never larger than LARGEST_WINDOW_SIZE.
+            optimized_interval: A fit of the bubble scores, reused instead of fitting again.
+        Returns:
+            The fitted observations and their fit.
+        """
+        observations = self.data_fit.observations
+        if optimized_interval:
+            interval_observations = observations.get_between_indexes(
+                optimized_interval.t1_index, optimized_interval.t2_index
+            )
+            return interval_observations, optimized_interval.optimized_params
 
-    def plot_fit(self, bubble_start: BubbleStart | None = None) -> None:
-        op = self.data_fit.fit(self.data_fit.observations)
+        if window_size is not None:
+            observations = observations[-window_size:]
+        op = self.data_fit.fit(observations)
         assert op is not None
-        self.data_fit.plot_fit(bubble_start, op)
+        return observations, op
+
+    def estimate_prices(
+        self,
+        window_size: int | None = None,
+        optimized_interval: OptimizedInterval | None = None,
+    ):
+        """
+        The fitted prices of the window of get_recent_fit, one per observation by default.
+        """
+        observations, op = self.get_recent_fit(window_size, optimized_interval)
+        return list(np.exp(LPPLSMath.get_log_price_predictions(observations, op)))
+
+    def plot_fit(
+        self,
+        bubble_start: BubbleStart | None = None,
+        window_size: int | None = LARGEST_WINDOW_SIZE,
+        optimized_interval: OptimizedInterval | None = None,
+    ) -> None:
+        observations, op = self.get_recent_fit(window_size, optimized_interval)
+        self.data_fit.plot_fit(bubble_start, op, observations)
 
     def compute_bubble_scores(self, **kwargs) -> List[BubbleScore]:
         all_fits = self.data_fit.parallel_compute_t2_recent_fits(**kwargs)
         return self.bubble_scores.compute_bubble_scores(all_fits, self.should_optimize)
 
+    def compute_multi_scale_bubble_scores(self, **kwargs) -> Dict[str, List[BubbleScore]]:
+        all_fits = self.data_fit.parallel_compute_multi_scale_fits(**kwargs)
+        return {
+            name: self.bubble_scores.compute_bubble_scores(fits, self.should_optimize)
+            for name, fits in all_fits.items()
+        }
+
     def plot_bubble_scores(self, bubble_scores, ticker, bubble_start, best_end_cluster):
         self.bubble_scores.plot_bubble_scores(bubble_scores, ticker, bubble_start, best_end_cluster)
 
@@ -0,0 +1,125 @@
+from typing import List, Tuple
+import numpy as np
+from scipy.optimize import minimize, least_squares
+from lppls.lppls_math import LPPLSMath, SINGULAR_FIT_COST
+from lppls.lppls_defaults import (
+    TC_PROFILE_GRID_SIZE,
+    TC_PROFILE_M_GRID_SIZE,
+    TC_PROFILE_W_GRID_SIZE,
+    TC_PROFILE_REFINED_TCS,
+    LEAST_SQUARES_MINIMIZERS,
+)
+from common.typechecking import TypeCheckBase
+
+
+# Profiles tc out of the fit, as in:
+# A Stable and Robust Calibration Scheme of the Log-Periodic Power Law Model (2013)
+# Authors: V. Filimonov, D. Sornette
+#
+# For a fixed tc only (m, w) is optimised, which is a much easier problem than the 3-D one.
+# This was first tried in archive/filimonov_plot.py, one tc at a time.
+class TcProfile(TypeCheckBase):
+    def __init__(self, search_bounds: List[Tuple[float, float]], minimizer: str = "Nelder-Mead"):
+        self.tc_bounds, self.m_bounds, self.w_bounds = search_bounds
+        self.minimizer = minimizer
+        # cost function evaluations, each lattice candidate counts as one
+        self.evaluations = 0
+
+    def get_tc_grid(self) -> np.ndarray:
+        return np.linspace(*self.tc_bounds, TC_PROFILE_GRID_SIZE)
+
+    def profile(
+        self, date_ordinals: np.ndarray, log_prices: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Evaluates a coarse (m, w) lattice at every tc of the grid in one batched call.
+        Returns:
+            The tc grid, the lowest cost found for each tc and the (m, w) it was found at.
+        """
+        tcs = self.get_tc_grid()
+        ms = self.cell_centres(self.m_bounds, TC_PROFILE_M_GRID_SIZE)
+        ws = self.cell_centres(self.w_bounds, TC_PROFILE_W_GRID_SIZE)
+
+        tc_mesh, m_mesh, w_mesh = np.meshgrid(tcs, ms, ws, indexing="ij")
+        candidates = np.stack([tc_mesh, m_mesh, w_mesh], axis=-1).reshape(len(tcs), -1, 3)
+        costs = LPPLSMath.batch_squared_residuals(candidates, date_ordinals, log_prices)
+        self.evaluations += costs.size
+
+        best = np.argmin(costs, axis=1)
+        best_mw = candidates[np.arange(len(tcs)), best, 1:]
+        return tcs, costs[np.arange(len(tcs)), best], best_mw
+
+    def optimize_at_tc(
+        self, tc: float, seed: np.ndarray, date_ordinals: np.ndarray, log_prices: np.ndarray
+    ) -> Tuple[np.ndarray, float] | None:
+        """
+        Optimises (m, w) at a fixed tc. The least_squares methods run on the profiled residuals
+        without their tc column, every other method goes to scipy.optimize.minimize.
+        """
+        if self.minimizer in LEAST_SQUARES_MINIMIZERS:
+
+            def residuals(x):
+                return LPPLSMath.profiled_residuals(np.array([tc, *x]), date_ordinals, log_prices)
+
+            def jacobian(x):
+                x = np.array([tc, *x])
+                return LPPLSMath.profiled_jacobian(x, date_ordinals, log_prices)[:, 1:]
+
+            (m_lower, m_upper), (w_lower, w_upper) = self.m_bounds, self.w_bounds
+            cofs = least_squares(
+                residuals,
+                x0=seed,
+                jac=jacobian,
+                bounds=((m_lower, w_lower), (m_upper, w_upper)),
+                method=self.minimizer,
+            )
+        else:
+            cofs = minimize(
+                args=(tc, date_ordinals, log_prices),
+                fun=LPPLSMath.fused_squared_residuals_with_fixed_tc,
+                x0=seed,
+                method=self.minimizer,
+                bounds=[self.m_bounds, self.w_bounds],
+            )
+        self.evaluations += cofs.nfev
+        cost = LPPLSMath.fused_squared_residuals_with_fixed_tc(
+            cofs.x, tc, date_ordinals, log_prices
+        )
+        if not cofs.success or cost >= SINGULAR_FIT_COST:
+            return None
+        return cofs.x, float(cost)
+
+    def fit(
+        self, date_ordinals: np.ndarray, log_prices: np.ndarray
+    ) -> Tuple[np.ndarray, List[Tuple[float, float]]] | None:
+        """
+        Returns:
+            The best (tc, m, w) found on the tc grid, and search bounds around it for a local 3-D
+            refinement: tc is only allowed to move up to the neighbouring grid points.
+        """
+        tcs, profile_costs, best_mw = self.profile(date_ordinals, log_prices)
+
+        best_x, best_cost, best_index = None, np.inf, 0
+        for i in np.argsort(profile_costs)[:TC_PROFILE_REFINED_TCS]:
+            if profile_costs[i] >= SINGULAR_FIT_COST:
+                continue
+            optimum = self.optimize_at_tc(tcs[i], best_mw[i], date_ordinals, log_prices)
+            if optimum is None:
+                continue
+            mw, cost = optimum
+            if cost < best_cost:
+                best_x, best_cost, best_index = np.array([tcs[i], *mw]), cost, int(i)
+
+        if best_x is None:
+            return None
+
+        refine_tc_bounds = (
+            float(tcs[max(best_index - 1, 0)]),
+            float(tcs[min(best_index + 1, len(tcs) - 1)]),
+        )
+        return best_x, [refine_tc_bounds, self.m_bounds, self.w_bounds]
+
+    @staticmethod
+    def cell_centres(bounds: Tuple[float, float], size: int) -> np.ndarray:
+        edges = np.linspace(*bounds, size + 1)
+        return (edges[:-1] + edges[1:]) / 2
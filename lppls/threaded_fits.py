@@ -0,0 +1,282 @@
+from typing import List, Tuple
+import time
+import numpy as np
+import numba
+from numba import njit, prange
+from lppls.lppls_math import LPPLSMath, SINGULAR_FIT_COST, _fused_squared_residuals
+from lppls.lppls_defaults import (
+    MAX_SEARCHES,
+    TRIES_TO_GET_MINIMUM,
+    THREADED_NELDER_MEAD_MAX_ITERATIONS,
+    THREADED_NELDER_MEAD_XATOL,
+    THREADED_NELDER_MEAD_FATOL,
+)
+from lppls.lppls_dataclasses import FitStats, ObservationSeries, OptimizedParams
+from lppls.filter_interface import FilterInterface
+from common.typechecking import TypeCheckBase
+
+# TBB keeps the interpreter from exiting once a multiprocessing.Pool has forked, and both backends
+# may run in the same process. It is only used if neither OpenMP nor the workqueue are available.
+THREADING_LAYER_PRIORITY = ["omp", "workqueue", "tbb"]
+
+
+@njit(cache=True, nogil=True, error_model="numpy")
+def _clip(x, lower, upper):
+    return np.minimum(np.maximum(x, lower), upper)
+
+
+@njit(cache=True, nogil=True, error_model="numpy")
+def _cost(date_ordinals, log_prices, x):
+    return _fused_squared_residuals(date_ordinals, log_prices, x[0], x[1], x[2])
+
+
+@njit(cache=True, nogil=True, error_model="numpy")
+def _nelder_mead(date_ordinals, log_prices, x0, lower, upper):
+    """
+    Bounded Nelder-Mead on the fused cost, the same steps, initial simplex and stopping rule as
+    scipy.optimize.minimize(method="Nelder-Mead") with its default options.
+    Returns:
+        The best vertex, its cost, whether the simplex converged, the number of evaluations and
+        of iterations.
+    """
+    n = x0.shape[0]
+    sim = np.empty((n + 1, n))
+    fsim = np.empty(n + 1)
+    sim[0] = _clip(x0, lower, upper)
+    for k in range(n):
+        vertex = sim[0].copy()
+        vertex[k] = vertex[k] * 1.05 if vertex[k] != 0 else 0.00025
+        # like scipy, a vertex above its upper bound is reflected into the bounds before clipping
+        vertex = np.where(vertex > upper, 2 * upper - vertex, vertex)
+        sim[k + 1] = _clip(vertex, lower, upper)
+    for k in range(n + 1):
+        fsim[k] = _cost(date_ordinals, log_prices, sim[k])
+    evaluations = n + 1
+
+    converged = False
+    # scipy counts the initial simplex as the first iteration
+    iterations = 1
+    while (
+        evaluations < THREADED_NELDER_MEAD_MAX_ITERATIONS
+        and iterations < THREADED_NELDER_MEAD_MAX_ITERATIONS
+    ):
+        order = np.argsort(fsim)
+        sim = sim[order]
+        fsim = fsim[order]
+        if (
+            np.max(np.abs(sim[1:] - sim[0])) <= THREADED_NELDER_MEAD_XATOL
+            and np.max(np.abs(fsim[0] - fsim[1:])) <= THREADED_NELDER_MEAD_FATOL
+        ):
+            converged = True
+            break
+
+        centroid = np.sum(sim[:-1], axis=0) / n
+        reflected = _clip(2 * centroid - sim[-1], lower, upper)
+        f_reflected = _cost(date_ordinals, log_prices, reflected)
+        evaluations += 1
+        shrink = False
+
+        if f_reflected < fsim[0]:
+            expanded = _clip(3 * centroid - 2 * sim[-1], lower, upper)
+            f_expanded = _cost(date_ordinals, log_prices, expanded)
+            evaluations += 1
+            if f_expanded < f_reflected:
+                sim[-1], fsim[-1] = expanded, f_expanded
+            else:
+                sim[-1], fsim[-1] = reflected, f_reflected
+        elif f_reflected < fsim[-2]:
+            sim[-1], fsim[-1] = reflected, f_reflected
+        elif f_reflected < fsim[-1]:
+            contracted = _clip(1.5 * centroid - 0.5 * sim[-1], lower, upper)
+            f_contracted = _cost(date_ordinals, log_prices, contracted)
+            evaluations += 1
+            if f_contracted <= f_reflected:
+                sim[-1], fsim[-1] = contracted, f_contracted
+            else:
+                shrink = True
+        else:
+            contracted = _clip(0.5 * centroid + 0.5 * sim[-1], lower, upper)
+            f_contracted = _cost(date_ordinals, log_prices, contracted)
+            evaluations += 1
+            if f_contracted < fsim[-1]:
+                sim[-1], fsim[-1] = contracted, f_contracted
+            else:
+                shrink = True
+
+        if shrink:
+            for k in range(1, n + 1):
+                sim[k] = _clip(sim[0] + 0.5 * (sim[k] - sim[0]), lower, upper)
+                fsim[k] = _cost(date_ordinals, log_prices, sim[k])
+            evaluations += n
+        iterations += 1
+
+    best = np.argmin(fsim)
+    return sim[best].copy(), fsim[best], converged, evaluations, iterations
+
+
+@njit(cache=True, parallel=True, error_model="numpy")
+def _fit_windows(date_ordinals, log_prices, lengths, seeds, bounds, tries_to_get_minimum):
+    """
+    Random restarts of every window in parallel threads, see ThreadedFits.fit_windows.
+    """
+    windows = lengths.shape[0]
+    # the minimum of every search that converged, the best one is picked like fit() picks it
+    search_x = np.zeros((windows, seeds.shape[1], 3))
+    converged_searches = np.zeros((windows, seeds.shape[1]), dtype=np.bool_)
+    searches = np.zeros(windows, dtype=np.int64)
+    evaluations = np.zeros(windows, dtype=np.int64)
+    iterations = np.zeros(windows, dtype=np.int64)
+    failed_searches = np.zeros(windows, dtype=np.int64)
+    exhausted = np.ones(windows, dtype=np.int64)
+    for i in prange(windows):
+        d = date_ordinals[i, : lengths[i]]
+        y = log_prices[i, : lengths[i]]
+        tries = 0
+        for s in range(seeds.shape[1]):
+            searches[i] += 1
+            x, cost, converged, nfev, nit = _nelder_mead(
+                d, y, seeds[i, s], bounds[i, :, 0], bounds[i, :, 1]
+            )
+            evaluations[i] += nfev
+            iterations[i] += nit
+            if not converged or cost >= SINGULAR_FIT_COST:
+                failed_searches[i] += 1
+                continue
+            tries += 1
+            search_x[i, s] = x
+            converged_searches[i, s] = True
+            if tries == tries_to_get_minimum:
+                exhausted[i] = 0
+                break
+    return (
+        search_x,
+        converged_searches,
+        searches,
+        evaluations,
+        iterations,
+        failed_searches,
+        exhausted,
+    )
+
+
+# Nelder-Mead random restarts of many windows in one process, across threads. The compiled kernels
+# release the GIL, so nothing is pickled and no worker process has to be started, which dominates
+# for small jobs like the single t2 window of should_optimize.
+class ThreadedFits(TypeCheckBase):
+    def __init__(
+        self,
+        filter: FilterInterface,
+        ticker: str = "",
+        max_searches: int = MAX_SEARCHES,
+        tries_to_get_minimum: int = TRIES_TO_GET_MINIMUM,
+    ):
+        self.filter = filter
+        self.ticker = ticker
+        self.max_searches = max_searches
+        self.tries_to_get_minimum = tries_to_get_minimum
+
+    def get_seeds(self, observations: ObservationSeries, seeds: List[np.ndarray]) -> np.ndarray:
+        """
+        The given seeds followed by the random ones FilterBitcoin2019B.fit would draw, from the
+        same window rng, max_searches in total.
+        """
+        search_bounds = self.filter.get_search_bounds(observations)
+        lower_bounds, upper_bounds = zip(*search_bounds)
+        rng = self.filter.get_window_rng(observations, self.ticker)
+
+        window_seeds = np.empty((self.max_searches, 3))
+        for search in range(self.max_searches):
+            if search < len(seeds):
+                window_seeds[search] = np.clip(seeds[search], lower_bounds, upper_bounds)
+            else:
+                window_seeds[search] = [rng.uniform(*bounds) for bounds in search_bounds]
+        return window_seeds
+
+    def fit_windows(
+        self,
+        windows: List[ObservationSeries],
+        seeds: List[List[np.ndarray]] | None = None,
+        threads: int | None = None,
+    ) -> Tuple[List[OptimizedParams | None], List[FitStats]]:
+        """
+        Args:
+            windows: The windows to fit, of any lengths.
+            seeds: Starting points tried first in each window, like the seeds of fit().
+            threads: The numba threads to fit on, all of them by default. The previous number of
+                threads is restored afterwards.
+        Returns:
+            The fit of each window, None where no search converged, and its FitStats. The searches
+            and the kept minimum are the ones fit() would have, so are the fits.
+        """
+        if not windows:
+            return [], []
+
+        seeds = seeds or [[] for _ in windows]
+        lengths = np.array([len(observations) for observations in windows])
+        date_ordinals = np.zeros((len(windows), lengths.max()))
+        log_prices = np.zeros((len(windows), lengths.max()))
+        for i, observations in enumerate(windows):
+            date_ordinals[i, : lengths[i]] = observations.get_date_ordinals()
+            log_prices[i, : lengths[i]] = observations.get_log_prices()
+        bounds = np.array([self.filter.get_search_bounds(observations) for observations in windows])
+        window_seeds = np.array(
+            [self.get_seeds(observations, s) for observations, s in zip(windows, seeds)]
+        )
+
+        # numba picks its threading layer on the first parallel call of a process, so only the
+        # processes that use this backend get this priority
+        setattr(numba.config, "THREADING_LAYER_PRIORITY", THREADING_LAYER_PRIORITY)
+        previous_threads = numba.get_num_threads()
+        if threads:
+            numba.set_num_threads(min(threads, getattr(numba.config, "NUMBA_NUM_THREADS")))
+        start = time.perf_counter()
+        try:
+            (
+                search_x,
+                converged_searches,
+                searches,
+                evaluations,
+                iterations,
+                failed_searches,
+                exhausted,
+            ) = _fit_windows(
+                date_ordinals,
+                log_prices,
+                lengths,
+                window_seeds,
+                bounds,
+                self.tries_to_get_minimum,
+            )
+        finally:
+            numba.set_num_threads(previous_threads)
+        # the windows share the threads, each is charged an equal part of the time
+        fit_seconds = (time.perf_counter() - start) / len(windows)
+
+        fits: List[OptimizedParams | None] = []
+        fit_stats: List[FitStats] = []
+        for i, observations in enumerate(windows):
+            # the lowest price error of the converged searches, the first one on ties, as in
+            # FilterBitcoin2019B.fit and compute_price_error
+            min_fit, min_error = None, np.inf
+            for tc, m, w in search_x[i, converged_searches[i]]:
+                a, b, c1, c2 = LPPLSMath.matrix_equation(observations, tc, m, w)
+                fit = OptimizedParams(tc, m, w, a, b, c1, c2)
+                error = float(np.sum(np.power(LPPLSMath.get_residuals(observations, fit), 2)))
+                if error < min_error:
+                    min_fit, min_error = fit, error
+
+            failed = min_fit is None
+            fit_stats.append(
+                FitStats(
+                    fits=1,
+                    failed_fits=int(failed),
+                    searches=int(searches[i]),
+                    evaluations=int(evaluations[i]),
+                    iterations=int(iterations[i]),
+                    failed_searches=int(failed_searches[i]),
+                    exhausted_fits=int(exhausted[i]),
+                    fit_seconds=fit_seconds,
+                )
+            )
+            fits.append(min_fit)
+        return fits, fit_stats